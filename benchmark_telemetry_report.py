@@ -0,0 +1,378 @@
+import os
+import gc
+import json
+import math
+import time
+import random
+import shutil
+import zipfile
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime, timezone
+
+import make_telemetry_report_for_openaudiotools as report
+
+
+# ---- Synthetic telemetry ---- #
+
+def pick_weighted(rng, values):
+	# Zipf-like pick, the first values are the most popular
+	weights = [1 / (rank + 1) for rank in range(len(values))]
+	return rng.choices(values, weights)[0]
+
+
+def make_frame(unix_time, installation, statement_type, **fields):
+	return {
+		"unixTime": str(unix_time),
+		"installationId": installation["id"],
+		"appName": APP_NAME,
+		"appVersion": installation["version"],
+		"statementType": statement_type,
+		**fields,
+	}
+
+
+def generate_installation_frames(rng, installation, end_time):
+	# Yield frames of one installation: launch, six hours reports on active days,
+	# checkpoints, functions and feedback
+	install_time = installation["install_time"]
+	yield make_frame(install_time, installation, "newInstallationLaunchReport",
+					 deviceType=installation["device_type"], language=installation["language"],
+					 country=installation["country"], timeZone=installation["time_zone"])
+
+	# Lifetime in days, most installations are gone after a few days
+	lifetime_days = min(int(rng.expovariate(1 / LIFETIME_DAYS_MEAN)), (end_time - install_time) // 86400)
+	usage_time = 0
+	checkpoints = list(DEFINITION["checkpoints"])
+	for day in range(lifetime_days + 1):
+		if day and rng.random() > ACTIVE_DAY_SHARE:
+			continue
+		day_time = install_time + day * 86400
+
+		# Reports every six hours while the app runs
+		for report_number in range(rng.randint(1, 4)):
+			unix_time = day_time + report_number * 21600 + rng.randint(0, 600)
+			if unix_time >= end_time:
+				break
+			yield make_frame(unix_time, installation, "sixHoursActivityReport")
+			usage_time += rng.randint(60, 7200)
+			yield make_frame(unix_time + 1, installation, "sixHoursUsageTimeReport", usageTime=str(usage_time))
+
+		# Checkpoints are reached once, in order
+		if day and checkpoints and rng.random() < CHECKPOINT_SHARE:
+			yield make_frame(day_time + 60, installation, "checkpoint", checkpointName=checkpoints.pop(0))
+
+		# Functions
+		for _ in range(int(rng.expovariate(1 / FUNCTIONS_PER_DAY_MEAN))):
+			yield make_frame(day_time + rng.randint(0, 86399), installation, "usedFunction",
+							 usedFunctionName=pick_weighted(rng, list(DEFINITION["functions"])))
+
+	# Feedback, some of it multi-line or with an invalid rating
+	if rng.random() < FEEDBACK_SHARE:
+		text = rng.choice(FEEDBACK_TEXTS)
+		rating = rng.choice([1, 2, 3, 4, 5, 5, 5, 0, "five"])
+		yield make_frame(install_time + rng.randint(0, lifetime_days * 86400 + 3600), installation,
+						 "userFeedbackFormWith5StarRatingAndText", text=text, **{"5StarRating": rating})
+
+
+def generate_synthetic_files(installations, days, seed):
+	# Yield (filename, content) of a synthetic telemetry source with a share of
+	# non-txt, non-json and non-standard files like the real one
+	rng = random.Random(seed)
+	end_time = START_TIME + days * 86400
+	file_number = 0
+	for number in range(installations):
+		installation = {
+			"id": f"{rng.getrandbits(64):016x}-{number}",
+			"version": pick_weighted(rng, APP_VERSIONS),
+			"install_time": START_TIME + rng.randint(0, days * 86400 - 1),
+			"device_type": rng.choices(["Android", "Desktop"], [3, 2])[0],
+			"language": pick_weighted(rng, LANGUAGES),
+			"country": pick_weighted(rng, COUNTRIES),
+			# Free-form client values keep growing the popularity tables
+			"time_zone": (pick_weighted(rng, TIME_ZONES) if rng.random() > 0.05
+						  else f"Etc/GMT{rng.randint(-12, 14):+d}:{rng.randint(0, 59):02d}"),
+		}
+		for frame in generate_installation_frames(rng, installation, end_time):
+			file_number += 1
+			filename = f"{frame['unixTime']}_{file_number}.txt"
+
+			# Damage some of the files
+			damage = rng.random()
+			if damage < NON_TXT_SHARE:
+				yield filename[:-4] + ".log", json.dumps(frame)
+			elif damage < NON_TXT_SHARE + NON_JSON_SHARE:
+				content = json.dumps(frame)
+				yield filename, content[:rng.randint(1, len(content) - 1)]
+			elif damage < NON_TXT_SHARE + NON_JSON_SHARE + NON_STANDARD_SHARE:
+				# Frames of another app or without an installation
+				if rng.random() < 0.5:
+					frame["appName"] = "UnknownApp"
+				else:
+					del frame["installationId"]
+				yield filename, json.dumps(frame)
+			else:
+				yield filename, json.dumps(frame)
+
+
+def write_synthetic_source(source, parameters):
+	# Generate the source, reuse it when it was generated with the same parameters
+	parameters_file = source + ".parameters.json"
+	if os.path.exists(source) and os.path.isfile(parameters_file):
+		with open(parameters_file, "r", encoding="utf-8") as f:
+			if json.load(f) == parameters:
+				return
+	if os.path.isdir(source):
+		shutil.rmtree(source)
+	elif os.path.isfile(source):
+		os.remove(source)
+
+	files = generate_synthetic_files(parameters["installations"], parameters["days"], parameters["seed"])
+	if report.is_zip_source(source):
+		with zipfile.ZipFile(source, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+			for filename, content in files:
+				archive.writestr(filename, content)
+	else:
+		os.makedirs(source)
+		for filename, content in files:
+			with open(os.path.join(source, filename), "w", encoding="utf-8") as f:
+				f.write(content)
+
+	with open(parameters_file, "w", encoding="utf-8") as f:
+		json.dump(parameters, f)
+
+
+# ---- Stages ---- #
+
+# Every stage takes the context of the earlier stages and adds its results to it
+
+def stage_load(context):
+	frames, *_ = report.load_telemetry_data(context["source"], use_cache=False)
+	context["frames"] = next(report.normalize_frames([frames]))
+
+
+def stage_user_actions(context):
+	context["categories"] = {}
+	context["user_actions"] = report.index_user_actions(
+		context["frames"], report.get_statement_routes(DEFINITION), context["categories"])
+
+
+def count_active_installations(rollups):
+	# Active users views of the report
+	for time_step in [3600, 86400, 604800, 2419200]:
+		report.count_statements_per_time_steps(rollups, "sixHoursActivityReport",
+											   report.START_TIME, report.END_TIME, time_step, "installations")
+
+
+def stage_bucket_counting(context):
+	# Hourly rollups of the user actions
+	users_count = max(1, len(context["categories"].get("installationId", ())))
+	count_active_installations({
+		"users_count": users_count,
+		"statements": report.build_statement_rollups(
+			context["user_actions"], context["user_actions"]["statement_codes"], users_count),
+	})
+
+
+def stage_bucket_counting_hll(context):
+	# Sketches are updated while frames are added, so this stage indexes the frames too
+	user_actions = report.add_user_actions(report.new_sketched_user_actions(
+		report.get_statement_routes(DEFINITION), report.get_installation_statements(DEFINITION),
+		report.HLL_PRECISION), context["frames"], {})
+	count_active_installations({"statements": report.build_sketched_statement_rollups(user_actions)})
+
+
+def stage_usage_deltas(context):
+	usage_reports = report.add_usage_reports(report.new_usage_reports(), context["frames"], context["categories"])
+	report.build_usage_rollups(usage_reports)
+
+
+def stage_popularity(context):
+	capacities = report.get_popularity_capacities(DEFINITION)
+	popularity = {field: {} for field in capacities}
+	report.add_popularity(popularity, context["frames"], capacities, DEFINITION["device_types"])
+	for field, counters_per_day in popularity.items():
+		counter = report.merge_popularity_per_day(counters_per_day, capacities[field], report.START_TIME, report.END_TIME)
+		report.get_popular_variants(counter)
+
+
+def stage_report_state(context):
+	context["reports"] = report.build_report_states(report.aggregate_frames([context["frames"]]))
+
+
+def stage_retention(context):
+	# Retention tables, curve and checkpoint funnel of the report
+	for app_name, report_state in context["reports"].items():
+		rollups = report_state["rollups"]
+		retention = report.build_retention(rollups, report.START_TIME, report.END_TIME)
+		for cohort_days in [1, 7]:
+			report.get_retention_matrix(retention, cohort_days, report.RETENTION_DAYS)
+		report.get_retention_curve(retention, report.RETENTION_DAYS)
+		report.get_funnel(rollups, report.REPORTS[app_name]["checkpoints"], report.START_TIME, report.END_TIME)
+
+
+def stage_charts(context):
+	# Statistics, feedback files and every chart of the report
+	report.rendered_graphs.clear()
+	report.display_reports(context["reports"], {category: 0 for category in report.REJECT_CATEGORIES})
+
+
+STAGES = [
+	("load", stage_load),
+	("user_actions", stage_user_actions),
+	("bucket_counting", stage_bucket_counting),
+	("bucket_counting_hll", stage_bucket_counting_hll),
+	("usage_deltas", stage_usage_deltas),
+	("popularity", stage_popularity),
+	("report_state", stage_report_state),
+	("retention", stage_retention),
+	("charts", stage_charts),
+]
+
+
+def run_stage(stage, context):
+	# Get (wall seconds, peak traced bytes or None), memory is traced in a second run
+	# so tracing does not slow down the timed one, allocations of worker processes are not traced
+	gc.collect()
+	started = time.perf_counter()
+	stage(context)
+	seconds = time.perf_counter() - started
+
+	peak = None
+	if MEASURE_MEMORY:
+		gc.collect()
+		tracemalloc.start()
+		stage(context)
+		_, peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+	return seconds, peak
+
+
+# ---- Results ---- #
+
+def get_revision():
+	try:
+		return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+							  cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def load_results(path):
+	if not os.path.isfile(path):
+		return []
+	with open(path, "r", encoding="utf-8") as f:
+		return json.load(f)
+
+
+def find_previous_result(results, parameters):
+	# Latest result measured on the same synthetic data
+	for result in reversed(results):
+		if result["parameters"] == parameters:
+			return result
+	return None
+
+
+def print_result(result, previous):
+	print(f"{result['frames']} frames, {result['files']} files, revision {result['revision']}")
+	print(f"{'stage':<20}{'seconds':>10}{'frames/s':>14}{'peak MB':>10}{'vs previous':>14}")
+	for name, stage in result["stages"].items():
+		peak = "-" if stage["peak_memory_mb"] is None else f"{stage['peak_memory_mb']:.1f}"
+		change = ""
+		if previous is not None and name in previous["stages"] and previous["stages"][name]["seconds"] > 0:
+			change = f"x{stage['seconds'] / previous['stages'][name]['seconds']:.2f}"
+		print(f"{name:<20}{stage['seconds']:>10.3f}{stage['frames_per_second']:>14.0f}{peak:>10}{change:>14}")
+
+
+def run_benchmark():
+	parameters = {
+		"installations": INSTALLATIONS,
+		"days": DAYS,
+		"seed": SEED,
+		"source": BENCHMARK_SOURCE,
+	}
+	os.makedirs(BENCHMARK_DIR, exist_ok=True)
+	source = os.path.join(BENCHMARK_DIR, "collected_telemetry.zip" if BENCHMARK_SOURCE == "zip"
+						  else "collected_telemetry")
+	print(f"Generating synthetic telemetry into {source}")
+	write_synthetic_source(source, parameters)
+
+	# Report into the benchmark dir, with the window covering all synthetic data
+	report.REPORT_DIR = os.path.join(BENCHMARK_DIR, "report")
+	report.START_TIME = START_TIME
+	report.END_TIME = START_TIME + DAYS * 86400
+	if os.path.isdir(report.REPORT_DIR):
+		shutil.rmtree(report.REPORT_DIR)
+
+	context = {"source": source}
+	stages = {}
+	for name, stage in STAGES:
+		seconds, peak = run_stage(stage, context)
+		frames_count = len(context["frames"])
+		stages[name] = {
+			"seconds": seconds,
+			"frames_per_second": frames_count / seconds if seconds > 0 else math.inf,
+			"peak_memory_mb": None if peak is None else peak / 1e6,
+		}
+
+	result = {
+		"time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+		"revision": get_revision(),
+		"python": platform.python_version(),
+		"cpu_count": os.cpu_count(),
+		"parameters": parameters,
+		"files": len(report.list_telemetry_files(source)),
+		"frames": len(context["frames"]),
+		"stages": stages,
+	}
+
+	# Keep every run, so regressions between versions are visible
+	results = load_results(RESULTS_FILE)
+	print_result(result, find_previous_result(results, parameters))
+	results.append(result)
+	with open(RESULTS_FILE, "w", encoding="utf-8") as f:
+		json.dump(results, f, indent=1)
+	print(f"Results saved into: {RESULTS_FILE}")
+
+
+# Config
+BENCHMARK_DIR = "telemetry_benchmark"
+BENCHMARK_SOURCE = "dir"  # "dir" or "zip", like TELEMETRY_SOURCE of the report
+RESULTS_FILE = "benchmark_results.json"
+MEASURE_MEMORY = True
+
+# Synthetic app
+APP_NAME = "OpenAudioTools"
+DEFINITION = report.REPORTS[APP_NAME]
+
+# Scale
+INSTALLATIONS = 2000
+DAYS = 90
+SEED = 1
+START_TIME = report.parse_date("2025/07/12")
+
+# Behaviour of synthetic installations
+LIFETIME_DAYS_MEAN = 10
+ACTIVE_DAY_SHARE = 0.6
+CHECKPOINT_SHARE = 0.3
+FUNCTIONS_PER_DAY_MEAN = 2
+FEEDBACK_SHARE = 0.05
+
+# Damaged files
+NON_TXT_SHARE = 0.002
+NON_JSON_SHARE = 0.002
+NON_STANDARD_SHARE = 0.004
+
+# Client values
+APP_VERSIONS = ["1.4.0", "1.3.2", "1.3.1", "1.2.0"]
+LANGUAGES = ["en", "de", "es", "fr", "ru", "pt", "it", "pl", "uk", "tr", "ja", "zh", "ko", "nl", "sv", "cs"]
+COUNTRIES = ["US", "DE", "BR", "IN", "RU", "FR", "GB", "ES", "IT", "PL", "UA", "TR", "JP", "MX", "CA", "NL"]
+TIME_ZONES = ["America/New_York", "Europe/Berlin", "America/Sao_Paulo", "Asia/Kolkata", "Europe/Moscow",
+			  "Europe/Paris", "Europe/London", "America/Los_Angeles", "Asia/Tokyo", "UTC"]
+FEEDBACK_TEXTS = ["Great app", "Crashes on start", "Please add\nMP3 export", "Works fine", "", "Too many ads"]
+
+
+# Process
+if __name__ == "__main__":
+	run_benchmark()
@@ -1,48 +1,334 @@
 import requests
 import zipfile
-import io
+import hashlib
+import json
 import os
 import shutil
+import time
 
 
 # Configuration
 API_URL = 'https://ktvincco.com/services/universal_telemetry/download_telemetry.php'
 TELEMETRY_DIR = "collected_telemetry"
+TELEMETRY_ZIP = "collected_telemetry.zip"
+UNPACK = False  # Keep only TELEMETRY_ZIP for zip ingest, or also unpack it into TELEMETRY_DIR
 API_KEY_FILE = "private/api_key.txt"
 
+# Download
+CHUNK_SIZE = 1024 * 1024  # bytes
+RETRIES = 5
+TIMEOUT = 60  # seconds
+PROGRESS_INTERVAL = 5  # seconds
+CHECKSUM_HEADER = "X-Checksum-SHA256"  # Verified when the server sends it
 
-# Read API key
-with open(API_KEY_FILE, 'r', encoding='utf-8') as f:
-    API_KEY = f.read().strip()
+# Sync
+SYNC = True  # Merge only new frames into TELEMETRY_ZIP instead of replacing it with the full history
+DELTA_ZIP = "collected_telemetry.delta.zip"
+MANIFEST_FILE = "collected_telemetry.manifest.json"
+MANIFEST_VERSION = 2
+WATERMARK_CLOCK_SKEW = 86400  # seconds, frames from further ahead of this clock do not move the watermark
 
 
-def fetch_and_unpack():
+class DownloadError(Exception):
+    pass
+
+
+def read_api_key():
+    with open(API_KEY_FILE, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def report_progress(done, total, received, elapsed):
+    rate = received / elapsed / 1e6 if elapsed > 0 else 0
+    of_total = f" of {total / 1e6:.1f}" if total else ""
+    print(f"Downloaded {done / 1e6:.1f}{of_total} MB ({rate:.1f} MB/s)")
+
+
+def download_part(api_url, api_key, part_path, fields):
+    # Stream the archive into part_path, continuing from its current size when the server honours Range
+    # Returns the checksum sent by the server, if any
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+    with requests.post(api_url, data={'api_key': api_key, **fields}, headers=headers,
+                       stream=True, timeout=TIMEOUT) as resp:
+
+        # Part file is already complete or stale, start over
+        if resp.status_code == 416:
+            os.remove(part_path)
+            raise requests.ConnectionError("Range not satisfiable, restarting download")
+
+        if resp.status_code not in (200, 206):
+            raise DownloadError(f"Error {resp.status_code}: {resp.text}")
+
+        # Get total size, append only when the server resumed from our offset
+        total = None
+        if resp.status_code == 206:
+            # Content-Range: bytes <start>-<end>/<total or *>
+            content_range = resp.headers.get('Content-Range', '')
+            byte_range, _, total = content_range.partition('/')
+            start = byte_range.replace('bytes', '').strip().partition('-')[0]
+            if not start.isdigit() or int(start) != offset:
+                raise requests.ConnectionError(f"Unexpected Content-Range: {content_range}")
+            total = int(total) if total.isdigit() else None
+        else:
+            offset = 0
+            length = resp.headers.get('Content-Length')
+            total = int(length) if length and length.isdigit() else None
+
+        # Write in fixed-size chunks
+        started = time.monotonic()
+        reported = started
+        received = 0
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                received += len(chunk)
+                now = time.monotonic()
+                if now - reported >= PROGRESS_INTERVAL:
+                    report_progress(offset + received, total, received, now - started)
+                    reported = now
+        report_progress(offset + received, total, received, time.monotonic() - started)
+
+        # Verify size
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            raise requests.ConnectionError(f"Connection closed at {size} of {total} bytes")
+
+        return resp.headers.get(CHECKSUM_HEADER)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def download_archive(api_url, api_key, zip_path, fields=None):
+    # Download into zip_path + ".part", resume after dropped connections,
+    # and replace zip_path only once the archive is complete and verified
+    part_path = zip_path + ".part"
+    fields = fields or {}
+
+    # Part files left by earlier runs may belong to a different archive
+    if os.path.isfile(part_path):
+        os.remove(part_path)
+
+    attempt = 0
+    while True:
+        try:
+            checksum = download_part(api_url, api_key, part_path, fields)
+            break
+        except requests.RequestException as e:
+            attempt += 1
+            if attempt > RETRIES:
+                raise DownloadError(f"Download failed after {RETRIES} retries: {e}")
+            print(f"Download interrupted ({e}), resuming ({attempt}/{RETRIES})")
+            time.sleep(min(2 ** attempt, 30))
+
+    # Verify checksum and archive
+    if checksum and file_sha256(part_path) != checksum.strip().lower():
+        os.remove(part_path)
+        raise DownloadError("Checksum mismatch, downloaded archive removed")
+    if not zipfile.is_zipfile(part_path):
+        os.remove(part_path)
+        raise DownloadError("Downloaded file is not a zip archive")
+
+    os.replace(part_path, zip_path)
+
+
+def fetch_and_unpack(api_url=API_URL):
 
     # Check API_KEY file
     if not os.path.isfile(API_KEY_FILE):
         print(f"Error {API_KEY_FILE} do not exist")
         return
 
-    # POST the key and fetch the zip
-    resp = requests.post(API_URL, data={'api_key': API_KEY}, stream=True)
-    if resp.status_code != 200:
-        print(f"Error {resp.status_code}: {resp.text}")
+    # POST the key and stream the zip to disk
+    try:
+        download_archive(api_url, read_api_key(), TELEMETRY_ZIP)
+    except DownloadError as e:
+        print(e)
         return
+    print(f"Data saved into: {TELEMETRY_ZIP}")
+
+    if UNPACK:
+        unpack(TELEMETRY_ZIP)
+
+
+def unpack(zip_path):
 
     # Ensure destination folder exists, overwrite any existing files
     if os.path.isdir(TELEMETRY_DIR):
         shutil.rmtree(TELEMETRY_DIR)
     os.makedirs(TELEMETRY_DIR, exist_ok=True)
 
-    # Read response content into a BytesIO
-    zip_bytes = io.BytesIO(resp.content)
-
     # Unpack
-    with zipfile.ZipFile(zip_bytes) as z:
+    with zipfile.ZipFile(zip_path) as z:
         z.extractall(TELEMETRY_DIR)
 
     print(f"Data unpacked into: {TELEMETRY_DIR}")
 
 
+def store_signature():
+    # Detect changes of the local store made without updating the manifest
+    if not os.path.isfile(TELEMETRY_ZIP):
+        return None
+    stat = os.stat(TELEMETRY_ZIP)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def frame_unix_time(content):
+    # unixTime of a standard frame, None for other files and client clock values from the future,
+    # like millisecond timestamps, which would move the watermark past every new frame
+    try:
+        frame = json.loads(content)
+        if not isinstance(frame.get("appName"), str) or "installationId" not in frame:
+            return None
+        unix_time = int(frame.get("unixTime"))
+    except (ValueError, TypeError, AttributeError):
+        return None
+    if unix_time > time.time() + WATERMARK_CLOCK_SKEW:
+        return None
+    return unix_time
+
+
+def add_to_manifest(manifest, name, content):
+    manifest["files"][name] = {"size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+
+    # Move the watermark
+    unix_time = frame_unix_time(content)
+    if unix_time is not None and (manifest["last_unix_time"] is None or unix_time > manifest["last_unix_time"]):
+        manifest["last_unix_time"] = unix_time
+    if manifest["last_file"] is None or name > manifest["last_file"]:
+        manifest["last_file"] = name
+
+
+def build_manifest():
+    # Index the frames of the local store as { name: { size, sha256 } } plus the watermark
+    # Returns None when the store is not a readable zip archive
+    manifest = {"version": MANIFEST_VERSION, "files": {}, "last_unix_time": None, "last_file": None}
+    if os.path.isfile(TELEMETRY_ZIP):
+        try:
+            with zipfile.ZipFile(TELEMETRY_ZIP) as store:
+                for info in store.infolist():
+                    if not info.is_dir():
+                        add_to_manifest(manifest, info.filename, store.read(info))
+        except zipfile.BadZipFile as e:
+            print(f"Error {TELEMETRY_ZIP} is not a readable zip archive ({e}), "
+                  f"restore it from a backup or remove it to download the full history")
+            return None
+    return manifest
+
+
+def load_manifest():
+    if os.path.isfile(MANIFEST_FILE):
+        with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        # Manifests of older versions may hold a watermark from a bad frame
+        if manifest.get("store") == store_signature() and manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        print(f"{MANIFEST_FILE} is out of date, rebuilding it from {TELEMETRY_ZIP}")
+    return build_manifest()
+
+
+def save_manifest(manifest):
+    manifest["store"] = store_signature()
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def merge_new_frames(delta_path, manifest):
+    # Append frames missing from the local store, never replace or delete existing ones
+    # Frames are appended to a copy of the store that replaces it once complete, like
+    # download_archive does with ".part", so an interrupted merge leaves the store intact
+    # and readers never see it half written
+    # Returns (new, already present, conflicting) frame counts
+    new_count = present_count = conflict_count = 0
+    tmp_path = TELEMETRY_ZIP + ".tmp"
+    if os.path.isfile(tmp_path):
+        os.remove(tmp_path)
+
+    store = None
+    try:
+        with zipfile.ZipFile(delta_path) as delta:
+            for info in delta.infolist():
+                if info.is_dir():
+                    continue
+                content = delta.read(info)
+
+                # Skip known frames, keep the local copy if the server sends different content
+                known = manifest["files"].get(info.filename)
+                if known is not None:
+                    if known["size"] == len(content) and known["sha256"] == hashlib.sha256(content).hexdigest():
+                        present_count += 1
+                    else:
+                        conflict_count += 1
+                    continue
+
+                # Copy the store on the first new frame, syncs without new frames leave it untouched
+                if store is None:
+                    if os.path.isfile(TELEMETRY_ZIP):
+                        shutil.copyfile(TELEMETRY_ZIP, tmp_path)
+                    store = zipfile.ZipFile(tmp_path, 'a', compression=zipfile.ZIP_DEFLATED)
+
+                store.writestr(zipfile.ZipInfo(info.filename, info.date_time), content,
+                               compress_type=zipfile.ZIP_DEFLATED)
+                if UNPACK:
+                    delta.extract(info, TELEMETRY_DIR)
+                add_to_manifest(manifest, info.filename, content)
+                new_count += 1
+
+        if store is not None:
+            store.close()
+            store = None
+            os.replace(tmp_path, TELEMETRY_ZIP)
+    finally:
+        if store is not None:
+            store.close()
+            os.remove(tmp_path)
+
+    return new_count, present_count, conflict_count
+
+
+def sync(api_url=API_URL):
+
+    # Check API_KEY file
+    if not os.path.isfile(API_KEY_FILE):
+        print(f"Error {API_KEY_FILE} do not exist")
+        return
+
+    # Ask only for frames after the watermark, servers that ignore it send the full history
+    manifest = load_manifest()
+    if manifest is None:
+        return
+    watermark = {
+        'since_unix_time': manifest["last_unix_time"] or 0,
+        'after_file': manifest["last_file"] or '',
+    }
+
+    # Download new frames
+    try:
+        download_archive(api_url, read_api_key(), DELTA_ZIP, watermark)
+    except DownloadError as e:
+        print(e)
+        return
+
+    # Merge them into the local store
+    new_count, present_count, conflict_count = merge_new_frames(DELTA_ZIP, manifest)
+    save_manifest(manifest)
+    os.remove(DELTA_ZIP)
+
+    print(f"Synced {new_count} new frames into: {TELEMETRY_ZIP} "
+          f"(already present: {present_count}, conflicting and kept local: {conflict_count})")
+
+
 if __name__ == '__main__':
-    fetch_and_unpack()
+    if SYNC:
+        sync()
+    else:
+        fetch_and_unpack()
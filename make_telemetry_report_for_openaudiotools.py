@@ -1,154 +1,1964 @@
 import os
+import argparse
 import json
+import hashlib
 import shutil
-from datetime import datetime, timedelta
+import time
+import cProfile
+import tracemalloc
+import sqlite3
+import zipfile
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-import matplotlib.pyplot as plt
-from orca.debug import println
-from sympy import floor
+import numpy as np
 
 
 def check_required_data_structure(data):
+	# Frames of apps without a report definition are non-standard
+	app_name = data.get("appName")
 	return ("unixTime" in data and "installationId" in
-			 data and data.get("appName") == "OpenAudioTools")
+			 data and isinstance(app_name, str) and app_name in REPORTS)
 
 
-def load_telemetry_data():
-	non_txt_count = 0
-	non_json_count = 0
-	non_standard_count = 0
-	files_data = []
+def is_zip_source(telemetry_source):
+	return telemetry_source.endswith(".zip")
 
-	# Define report subdirs
-	non_txt_dir = os.path.join(REPORT_DIR, "non_txt")
-	txt_non_json_dir = os.path.join(REPORT_DIR, "txt_non_json")
-	txt_json_non_standard_dir = os.path.join(REPORT_DIR, "txt_json_non_standard")
 
-	# Make sure they exist
-	os.makedirs(non_txt_dir, exist_ok=True)
-	os.makedirs(txt_non_json_dir, exist_ok=True)
-	os.makedirs(txt_json_non_standard_dir, exist_ok=True)
+def open_telemetry_zip(zip_path):
+	# Open an archive once per process and reuse it for every batch,
+	# forked workers must not share the parent's file position
+	path = os.path.abspath(zip_path)
+	key = (os.getpid(), path, os.stat(zip_path).st_mtime_ns)
+	if key not in opened_telemetry_zips:
+		# Close older versions of the archive, a watch would keep one open per change otherwise
+		for old_key in [old_key for old_key in opened_telemetry_zips if old_key[1] == path]:
+			opened_telemetry_zips.pop(old_key).close()
+		opened_telemetry_zips[key] = zipfile.ZipFile(zip_path)
+	return opened_telemetry_zips[key]
+
+
+def list_telemetry_files(telemetry_source):
+	# List files of a telemetry directory or members of a telemetry archive
+	if is_zip_source(telemetry_source):
+		return [info.filename for info in open_telemetry_zip(telemetry_source).infolist()
+				if not info.is_dir()]
+	return os.listdir(telemetry_source)
+
+
+def read_telemetry_file(telemetry_source, archive, filename):
+	# Read a file from a telemetry directory or straight from the archive without extracting it
+	if archive is not None:
+		return archive.read(filename).decode("utf-8")
+	with open(os.path.join(telemetry_source, filename), "r", encoding="utf-8") as f:
+		return f.read()
+
+
+def quarantine_telemetry_file(telemetry_source, archive, filename, quarantine_dir):
+	# Copy a rejected file into the report
+	if archive is None:
+		shutil.copy2(os.path.join(telemetry_source, filename), quarantine_dir)
+		return
+	with open(os.path.join(quarantine_dir, os.path.basename(filename)), "wb") as f:
+		f.write(archive.read(filename))
 
-	for filename in os.listdir(TELEMETRY_DIR):
-		src_path = os.path.join(TELEMETRY_DIR, filename)
+
+def read_telemetry_files(telemetry_source, filenames):
+	# Parse a batch of files as (valid frames, valid, non_txt, non_json, non_standard file names)
+	files_data = []
+	valid = []
+	non_txt = []
+	non_json = []
+	non_standard = []
+
+	archive = open_telemetry_zip(telemetry_source) if is_zip_source(telemetry_source) else None
+
+	for filename in filenames:
 
 		# Skip directories silently like a mature program
-		if not os.path.isfile(src_path):
+		if archive is None and not os.path.isfile(os.path.join(telemetry_source, filename)):
 			continue
 
 		# Read only .txt files
 		if not filename.endswith(".txt"):
-			non_txt_count += 1
-			shutil.copy2(src_path, non_txt_dir)
+			non_txt.append(filename)
 			continue
 
 		# Read only json files + count non json
 		try:
-			with open(src_path, "r", encoding="utf-8") as f:
-				content = f.read().strip()
+			content = read_telemetry_file(telemetry_source, archive, filename).strip()
 			file_data = json.loads(content)
-		except (json.JSONDecodeError, UnicodeDecodeError, OSError):
-			non_json_count += 1
-			shutil.copy2(src_path, txt_non_json_dir)
+		except (json.JSONDecodeError, UnicodeDecodeError, OSError, zipfile.BadZipFile):
+			non_json.append(filename)
 			continue
 
 		# Count non-standard files and skip
 		if not check_required_data_structure(file_data):
-			non_standard_count += 1
-			shutil.copy2(src_path, txt_json_non_standard_dir)
+			non_standard.append(filename)
 			continue
 
 		# Collect valid data
 		files_data.append(file_data)
+		valid.append(filename)
+
+	return files_data, valid, non_txt, non_json, non_standard
+
+
+def parse_telemetry_files(telemetry_source, filenames, workers, chunk_size):
+	# Shard files into batches and parse them serially or in a process pool,
+	# yielding read_telemetry_files results per batch
+	batches = [filenames[i:i + chunk_size] for i in range(0, len(filenames), chunk_size)]
+	if workers <= 1 or len(batches) <= 1:
+		for batch in batches:
+			yield read_telemetry_files(telemetry_source, batch)
+		return
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		# Keep a few batches per worker in flight, so parsed batches never pile up ahead of the consumer
+		pending = deque()
+		for batch in batches:
+			pending.append(executor.submit(read_telemetry_files, telemetry_source, batch))
+			if len(pending) >= 2 * workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+
+
+def stream_telemetry_data(telemetry_source=None, workers=None, chunk_size=None, use_cache=None,
+		rejected_counts=None, filenames=None):
+	# Yield batches of valid frames, rejected files are quarantined and counted
+	# into rejected_counts as { category: count } while the stream is consumed
+	# filenames limits the stream to the given files of the source
+	telemetry_source = get_telemetry_source() if telemetry_source is None else telemetry_source
+	workers = INGEST_WORKERS if workers is None else workers
+	chunk_size = INGEST_CHUNK_SIZE if chunk_size is None else chunk_size
+	use_cache = USE_FRAME_CACHE if use_cache is None else use_cache
+	rejected_counts = {} if rejected_counts is None else rejected_counts
+	for category in REJECT_CATEGORIES:
+		rejected_counts[category] = 0
+
+	# Define report subdirs
+	non_txt_dir = os.path.join(REPORT_DIR, "non_txt")
+	txt_non_json_dir = os.path.join(REPORT_DIR, "txt_non_json")
+	txt_json_non_standard_dir = os.path.join(REPORT_DIR, "txt_json_non_standard")
+	quarantine_dirs = [non_txt_dir, txt_non_json_dir, txt_json_non_standard_dir]
 
-	return files_data, non_txt_count, non_json_count, non_standard_count
+	# Make sure they exist
+	os.makedirs(non_txt_dir, exist_ok=True)
+	os.makedirs(txt_non_json_dir, exist_ok=True)
+	os.makedirs(txt_json_non_standard_dir, exist_ok=True)
 
+	# Parse given files, new and changed files only, or everything
+	if filenames is not None:
+		batches = parse_telemetry_files(telemetry_source, list(filenames), workers, chunk_size)
+	elif use_cache:
+		batches = stream_telemetry_data_cached(telemetry_source, workers, chunk_size)
+	else:
+		batches = parse_telemetry_files(
+			telemetry_source, list_telemetry_files(telemetry_source), workers, chunk_size)
 
-def get_users_action_structure(data):
-	# Get user actions structure as { installationId: { statement: [ unixTime ] } }
-	user_actions = {}
-	for frame in data:
-		iid = frame.get("installationId")
-		if iid not in user_actions.keys():
-			user_actions[iid] = {}
+	archive = open_telemetry_zip(telemetry_source) if is_zip_source(telemetry_source) else None
+	for files_data, _, *rejected in batches:
+
+		# Quarantine rejected files
+		for category, filenames, quarantine_dir in zip(REJECT_CATEGORIES, rejected, quarantine_dirs):
+			for filename in filenames:
+				quarantine_telemetry_file(telemetry_source, archive, filename, quarantine_dir)
+			rejected_counts[category] += len(filenames)
+			count_items(f"files_{category}", len(filenames))
+
+		if files_data:
+			count_items("files_valid", len(files_data))
+			yield files_data
+
+
+def load_telemetry_data(telemetry_source=None, workers=None, chunk_size=None, use_cache=None):
+	# Collect the whole stream into one list of frames
+	rejected_counts = {}
+	files_data = []
+	for frames in stream_telemetry_data(telemetry_source, workers, chunk_size, use_cache, rejected_counts):
+		files_data.extend(frames)
+	return files_data, rejected_counts["non_txt"], rejected_counts["non_json"], rejected_counts["non_standard"]
+
+
+# ---- Frame cache ---- #
+
+# Cache layout (per telemetry source, in CACHE_DIR/<name>_<hash of its absolute path>):
+#   meta.json          version, apps, file names, field names and per-field value tables
+#   sizes.npy          file size        } keys deciding whether
+#   stamps.npy         mtime ns or CRC  } a file must be parsed again
+#   status.npy         FRAME_VALID or index in REJECT_CATEGORIES + 1
+#   column_<i>.npy     codes of field i per file, -1 when missing
+#   values_<i>.npy     int64 values of INT_CACHE_FIELDS field i, coded CACHE_INT or CACHE_DECIMAL
+
+FRAME_CACHE_VERSION = 2
+FRAME_VALID = 0
+REJECT_CATEGORIES = ["non_txt", "non_json", "non_standard"]
+
+# Nearly unique integer fields are kept as int64 values instead of growing the value tables,
+# other values of them, like non-integer strings, still go to the tables
+INT_CACHE_FIELDS = {"unixTime", "usageTime"}
+CACHE_INT = -2  # an int
+CACHE_DECIMAL = -3  # the decimal string of an int, as clients send unixTime
+
+
+def get_frame_cache_dir(telemetry_source):
+	# Keyed by the absolute path, sources with the same name like nodeA/2025_07 and nodeB/2025_07 must not collide
+	path = os.path.abspath(telemetry_source)
+	path_hash = hashlib.sha256(path.encode("utf-8")).hexdigest()[:12]
+	return os.path.join(CACHE_DIR, f"{os.path.basename(path)}_{path_hash}")
+
+
+def stat_telemetry_files(telemetry_source):
+	# Get { filename: (size, stamp) }, the stamp is mtime for directories and CRC for archives
+	if is_zip_source(telemetry_source):
+		return {info.filename: (info.file_size, info.CRC)
+				for info in open_telemetry_zip(telemetry_source).infolist() if not info.is_dir()}
+	stats = {}
+	for entry in os.scandir(telemetry_source):
+		if entry.is_file():
+			stat = entry.stat()
+			stats[entry.name] = (stat.st_size, stat.st_mtime_ns)
+	return stats
+
+
+def new_frame_cache():
+	return {
+		"names": [],
+		"sizes": np.empty(0, dtype=np.int64),
+		"stamps": np.empty(0, dtype=np.int64),
+		"status": np.empty(0, dtype=np.int8),
+		"columns": {},
+		"values": {},
+		"tables": {},
+	}
+
+
+def load_frame_cache(cache_dir):
+	try:
+		with open(os.path.join(cache_dir, "meta.json"), "r", encoding="utf-8") as f:
+			meta = json.load(f)
+		# Files are valid or non-standard depending on the apps with a report
+		if meta.get("version") != FRAME_CACHE_VERSION or meta.get("apps") != sorted(REPORTS):
+			return None
+		cache = {
+			"names": meta["names"],
+			"sizes": np.load(os.path.join(cache_dir, "sizes.npy"), mmap_mode="r"),
+			"stamps": np.load(os.path.join(cache_dir, "stamps.npy"), mmap_mode="r"),
+			"status": np.load(os.path.join(cache_dir, "status.npy"), mmap_mode="r"),
+			"columns": {},
+			"values": {},
+			"tables": dict(zip(meta["fields"], meta["tables"])),
+		}
+		for i, field in enumerate(meta["fields"]):
+			cache["columns"][field] = np.load(os.path.join(cache_dir, f"column_{i}.npy"), mmap_mode="r")
+			if field in INT_CACHE_FIELDS:
+				cache["values"][field] = np.load(os.path.join(cache_dir, f"values_{i}.npy"), mmap_mode="r")
+	except (OSError, ValueError, KeyError):
+		return None
+	return cache
+
+
+def save_frame_cache(cache_dir, cache):
+	# Write into a temporary dir and swap it in, so an interrupted run never leaves a broken cache
+	tmp_dir = cache_dir + ".tmp"
+	if os.path.isdir(tmp_dir):
+		shutil.rmtree(tmp_dir)
+	os.makedirs(tmp_dir)
+
+	fields = list(cache["columns"])
+	np.save(os.path.join(tmp_dir, "sizes.npy"), cache["sizes"])
+	np.save(os.path.join(tmp_dir, "stamps.npy"), cache["stamps"])
+	np.save(os.path.join(tmp_dir, "status.npy"), cache["status"])
+	for i, field in enumerate(fields):
+		np.save(os.path.join(tmp_dir, f"column_{i}.npy"), cache["columns"][field])
+		if field in INT_CACHE_FIELDS:
+			np.save(os.path.join(tmp_dir, f"values_{i}.npy"), cache["values"][field])
+	with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+		json.dump({
+			"version": FRAME_CACHE_VERSION,
+			"apps": sorted(REPORTS),
+			"names": cache["names"],
+			"fields": fields,
+			"tables": [cache["tables"][field] for field in fields],
+		}, f)
+
+	if os.path.isdir(cache_dir):
+		shutil.rmtree(cache_dir)
+	os.replace(tmp_dir, cache_dir)
+
+
+def new_frame_cache_update(cache, keep_rows):
+	# Start a new cache from the kept rows of the old one, parsed files are added
+	# batch by batch with add_frame_cache_rows and the cache is built by finish_frame_cache_update
+	return {
+		"cache": cache,
+		"keep_rows": np.asarray(keep_rows, dtype=np.int64),
+		"names": [],
+		"sizes": array("q"),
+		"stamps": array("q"),
+		"status": array("b"),
+		"columns": {},
+		"values": {},
+		"tables": {field: list(table) for field, table in cache["tables"].items()},
+		"lookups": {field: {json.dumps(value, sort_keys=True): code for code, value in enumerate(table)}
+					for field, table in cache["tables"].items()},
+	}
+
+
+def encode_cache_int(value):
+	# Get (code, int) of a value of INT_CACHE_FIELDS kept as int64, None when it goes to the value table
+	if type(value) is int:
+		return (CACHE_INT, value) if value in INT64_RANGE else None
+	if not isinstance(value, str):
+		return None
+	try:
+		number = int(value)
+	except ValueError:
+		return None
+	# Only strings that decode back to themselves
+	if number not in INT64_RANGE or str(number) != value:
+		return None
+	return CACHE_DECIMAL, number
+
+
+def add_frame_cache_rows(update, parsed):
+	# Add parsed (filename, size, stamp, status, frame) entries, dictionary-encoding frames
+	# into compact code columns, extending the value tables
+	columns = update["columns"]
+	values = update["values"]
+	for filename, size, stamp, status, frame in parsed:
+		row = len(update["names"])
+		update["names"].append(filename)
+		update["sizes"].append(size)
+		update["stamps"].append(stamp)
+		update["status"].append(status)
+
+		for field, value in (frame or {}).items():
+			column = columns.get(field)
+			if column is None:
+				column = columns[field] = array("i", [-1]) * row
+				if field in INT_CACHE_FIELDS:
+					values[field] = array("q", [0]) * row
+			if field in INT_CACHE_FIELDS:
+				encoded = encode_cache_int(value)
+				if encoded is not None:
+					column.append(encoded[0])
+					values[field].append(encoded[1])
+					continue
+				values[field].append(0)
+			if field not in update["tables"]:
+				update["tables"][field] = []
+				update["lookups"][field] = {}
+			key = json.dumps(value, sort_keys=True)
+			code = update["lookups"][field].get(key)
+			if code is None:
+				code = update["lookups"][field][key] = len(update["tables"][field])
+				update["tables"][field].append(value)
+			column.append(code)
+
+		# Fields missing from the frame
+		for field, column in columns.items():
+			if len(column) == row:
+				column.append(-1)
+				if field in INT_CACHE_FIELDS:
+					values[field].append(0)
+
+
+def finish_frame_cache_update(update):
+	cache = update["cache"]
+	keep_rows = update["keep_rows"]
+	kept_count = len(keep_rows)
+	rows_count = kept_count + len(update["names"])
+
+	new_cache = {
+		"names": [cache["names"][row] for row in keep_rows.tolist()] + update["names"],
+		"sizes": np.concatenate([cache["sizes"][keep_rows], np.frombuffer(update["sizes"], dtype=np.int64)]),
+		"stamps": np.concatenate([cache["stamps"][keep_rows], np.frombuffer(update["stamps"], dtype=np.int64)]),
+		"status": np.concatenate([cache["status"][keep_rows], np.frombuffer(update["status"], dtype=np.int8)]),
+		"columns": {},
+		"values": {},
+		"tables": update["tables"],
+	}
+	for field in dict.fromkeys([*cache["columns"], *update["columns"]]):
+		column = np.full(rows_count, -1, dtype=np.int32)
+		if field in cache["columns"]:
+			column[:kept_count] = cache["columns"][field][keep_rows]
+		if field in update["columns"]:
+			column[kept_count:] = np.frombuffer(update["columns"][field], dtype=np.int32)
+		new_cache["columns"][field] = column
+		new_cache["tables"].setdefault(field, [])
+
+		if field in INT_CACHE_FIELDS:
+			values = np.zeros(rows_count, dtype=np.int64)
+			if field in cache["values"]:
+				values[:kept_count] = cache["values"][field][keep_rows]
+			if field in update["values"]:
+				values[kept_count:] = np.frombuffer(update["values"][field], dtype=np.int64)
+			new_cache["values"][field] = values
+	return new_cache
+
+
+def frames_from_cache(cache, rows):
+	# Decode rows back into frames, equal values share one object
+	frames = [{} for _ in range(len(rows))]
+	for field, codes in cache["columns"].items():
+		table = cache["tables"][field]
+		codes = codes[rows]
+		present = np.flatnonzero(codes >= 0)
+		for i, code in zip(present.tolist(), codes[present].tolist()):
+			frames[i][field] = table[code]
+
+		if field in cache["values"]:
+			values = cache["values"][field][rows]
+			for code, decode in [(CACHE_INT, int), (CACHE_DECIMAL, str)]:
+				present = np.flatnonzero(codes == code)
+				for i, value in zip(present.tolist(), values[present].tolist()):
+					frames[i][field] = decode(value)
+	return frames
+
+
+def stream_telemetry_data_cached(telemetry_source, workers, chunk_size):
+	# Parse only files that are new or changed (by name, size and mtime/CRC) since the last run,
+	# yielding batches shaped like read_telemetry_files results: cached files first, then parsed
+	# batches as they arrive, which are encoded into the cache on the way
+	cache_dir = get_frame_cache_dir(telemetry_source)
+	cache = load_frame_cache(cache_dir)
+	if cache is None:
+		cache = new_frame_cache()
+
+	# Find unchanged files
+	stats = stat_telemetry_files(telemetry_source)
+	cached_rows = {name: row for row, name in enumerate(cache["names"])}
+	keep_rows = []
+	changed = []
+	for filename, (size, stamp) in stats.items():
+		row = cached_rows.get(filename)
+		if row is not None and cache["sizes"][row] == size and cache["stamps"][row] == stamp:
+			keep_rows.append(row)
+		else:
+			changed.append(filename)
+	keep_rows = np.asarray(keep_rows, dtype=np.int64)
+
+	# Cached files, rejected first, then frames decoded batch by batch
+	status = np.asarray(cache["status"])[keep_rows]
+	yield [], [], *[[cache["names"][row] for row in keep_rows[status == category].tolist()]
+					for category in range(1, len(REJECT_CATEGORIES) + 1)]
+	valid_rows = keep_rows[status == FRAME_VALID]
+	for start in range(0, len(valid_rows), chunk_size):
+		yield frames_from_cache(cache, valid_rows[start:start + chunk_size]), [], [], [], []
+
+	# Parse the rest, frames are encoded before consumers change them
+	update = new_frame_cache_update(cache, keep_rows)
+	for files_data, valid, *rejected in parse_telemetry_files(telemetry_source, changed, workers, chunk_size):
+		parsed = [(filename, *stats[filename], FRAME_VALID, frame) for filename, frame in zip(valid, files_data)]
+		for status, filenames in enumerate(rejected, 1):
+			parsed.extend((filename, *stats[filename], status, None) for filename in filenames)
+		add_frame_cache_rows(update, parsed)
+		yield files_data, valid, *rejected
+
+	# Save only when something changed
+	if changed or len(keep_rows) != len(cache["names"]):
+		save_frame_cache(cache_dir, finish_frame_cache_update(update))
+
+
+def get_telemetry_source():
+	# Read the downloaded archive directly, or the unpacked directory
+	if TELEMETRY_SOURCE == "zip":
+		return TELEMETRY_ZIP
+	return TELEMETRY_DIR
+
+
+# Frame fields matched against the lists of a report definition
+ROUTED_FIELDS = {
+	"statementType": "statements",
+	"checkpointName": "checkpoints",
+	"usedFunctionName": "functions",
+	"deviceType": "device_types",
+}
+
+
+def get_statement_routes(definition):
+	# Get frame fields to index as { field: { statement } } from a report definition
+	return {field: set(definition[key]) for field, key in ROUTED_FIELDS.items()}
+
+
+def get_category_code(categories, field, value):
+	# Dictionary-encode a categorical value like an installationId into a small integer code,
+	# the { field: { value: code } } tables are shared by all aggregates
+	codes = categories.get(field)
+	if codes is None:
+		codes = categories[field] = {}
+	code = codes.get(value)
+	if code is None:
+		code = codes[value] = len(codes)
+	return code
+
+
+def get_statement_codes(routes):
+	# Number statements of all routed fields as { field: { statement: code } }
+	statement_codes = {}
+	field_codes = {}
+	for field, statements in routes.items():
+		field_codes[field] = {}
+		for statement in sorted(statements):
+			if statement not in statement_codes:
+				statement_codes[statement] = len(statement_codes)
+			field_codes[field][statement] = statement_codes[statement]
+	return statement_codes, field_codes
+
+
+def new_user_actions(routes):
+	# User actions as parallel compact (user code, statement code, unixTime) columns
+	statement_codes, field_codes = get_statement_codes(routes)
+	return {
+		"statement_codes": statement_codes,
+		"routes": list(field_codes.items()),
+		"users": array("q"),
+		"statements": array("q"),
+		"times": array("q"),
+	}
+
+
+def get_installation_statements(definition):
+	# Statements the report counts installations of, the others are counted as events only
+	statements = {"newInstallationLaunchReport", *definition["device_types"], *definition["checkpoints"]}
+	statements.update(graph["statement"] for graph in definition["graphs"] if graph["per_installation"])
+	return statements
+
+
+def new_sketched_user_actions(routes, installation_statements, precision):
+	# User actions of DISTINCT_COUNTING = "hll", updated while frames are added instead of keeping
+	# per-event columns: events per { hour * statements count + statement code: count }, sketches of
+	# installations for the same keys of installation_statements, and the first and last
+	# sixHoursActivityReport time and the report count as { user code: [first, last, count] }
+	statement_codes, field_codes = get_statement_codes(routes)
+	return {
+		"statement_codes": statement_codes,
+		"routes": list(field_codes.items()),
+		"sketched": {statement_codes[statement] for statement in installation_statements
+					 if statement in statement_codes},
+		"precision": precision,
+		"counts": {},
+		"sketches": {},
+		"user_hashes": {},
+		"lifetime": {},
+	}
+
+
+def add_sketched_user_actions(user_actions, frames, categories):
+	counts = user_actions["counts"]
+	sketches = user_actions["sketches"]
+	user_hashes = user_actions["user_hashes"]
+	lifetime = user_actions["lifetime"]
+	sketched = user_actions["sketched"]
+	precision = user_actions["precision"]
+	statement_codes = user_actions["statement_codes"]
+	statements_count = len(statement_codes)
+	lifetime_code = statement_codes.get("sixHoursActivityReport")
+	for frame in frames:
+		installation_id = frame.get("installationId")
+		user = get_category_code(categories, "installationId", installation_id)
+		unix_time = frame["unixTime"]
+		hour = get_time_buckets(unix_time, ROLLUP_STEP)
+		for field, field_codes in user_actions["routes"]:
+			statement = frame.get(field)
+			if not isinstance(statement, str):
+				continue
+			code = field_codes.get(statement)
+			if code is None:
+				continue
+			key = hour * statements_count + code
+			counts[key] = counts.get(key, 0) + 1
+
+			if code in sketched:
+				user_hash = user_hashes.get(user)
+				if user_hash is None:
+					user_hash = user_hashes[user] = hash_installation(installation_id)
+				sketch = sketches.get(key)
+				if sketch is None:
+					sketch = sketches[key] = bytearray(1 << precision)
+				add_to_sketch(sketch, user_hash, precision)
+
+			if code == lifetime_code:
+				times = lifetime.get(user)
+				if times is None:
+					lifetime[user] = [unix_time, unix_time, 1]
+				else:
+					times[0] = min(times[0], unix_time)
+					times[1] = max(times[1], unix_time)
+					times[2] += 1
 	return user_actions
 
 
-def add_statement_per_user(data, user_actions, statement_type, statement):
-	# Count particular statements like "statementType": "sixHoursActivityReport" per user
-	for frame in data:
-		if statement_type in frame and frame.get(statement_type) == statement:
-			iid = frame.get("installationId")
-			unix_time = frame.get("unixTime")
-			if statement not in user_actions[iid]:
-				user_actions[iid][statement] = []
-			user_actions[iid][statement].append(unix_time)
+def add_user_actions(user_actions, frames, categories):
+	# Add frames to user actions, routing each frame to every (field, value) bucket it matches
+	if "sketches" in user_actions:
+		return add_sketched_user_actions(user_actions, frames, categories)
+	users = user_actions["users"]
+	statements = user_actions["statements"]
+	times = user_actions["times"]
+	for frame in frames:
+		user = get_category_code(categories, "installationId", frame.get("installationId"))
+		for field, statement_codes in user_actions["routes"]:
+			statement = frame.get(field)
+			if not isinstance(statement, str):
+				continue
+			code = statement_codes.get(statement)
+			if code is None:
+				continue
+			users.append(user)
+			statements.append(code)
+			times.append(frame["unixTime"])
 	return user_actions
 
 
-def count_statements(user_actions, statement):
-	# Count particular statements like "statementType": "sixHoursActivityReport" overall
-	statements_count = 0
-	for user in user_actions:
-		if statement in user_actions[user]:
-			for date in user_actions[user][statement]:
-				if START_TIME < int(date) < END_TIME:
-					statements_count += 1
-	return statements_count
-
-
-def count_users_with_existent_statement(user_actions, statement):
-	# Count users who have at least one particular statement
-	users_count = 0
-	for user in user_actions:
-		if statement in user_actions[user]:
-			for date in user_actions[user][statement]:
-				if START_TIME < int(date) < END_TIME:
-					users_count += 1
-					continue
-	return users_count
+def sort_user_actions(user_actions):
+	# Freeze action columns into NumPy arrays sorted by statement, user and time
+	users = np.frombuffer(user_actions["users"], dtype=np.int64)
+	statements = np.frombuffer(user_actions["statements"], dtype=np.int64)
+	times = np.frombuffer(user_actions["times"], dtype=np.int64)
+	order = np.lexsort((times, users, statements))
+	return {
+		"statement_codes": user_actions["statement_codes"],
+		"users": users[order],
+		"statements": statements[order],
+		"times": times[order],
+	}
 
 
-def count_statements_per_time_frame(
-		user_actions, statement, start_time, end_time, is_max_one_per_frame=False):
-	# Count users who have at least one particular statement
-	statements_count = 0
-	for user in user_actions:
-		if statement in user_actions[user]:
-			dates = user_actions[user][statement]
-			for date in dates:
-				if start_time < int(date) < end_time:
-					statements_count += 1
-					if is_max_one_per_frame:
-						continue
-	return statements_count
+def index_user_actions(data, routes, categories=None):
+	# Index normalized frames in a single pass, see new_user_actions
+	categories = {} if categories is None else categories
+	user_actions = add_user_actions(new_user_actions(routes), data, categories)
+	return sort_user_actions(user_actions)
 
 
-def calculate_graph_data_by_statements_count_per_time(
-		user_actions, statement, start_time, end_time, time_step, is_max_one_per_time_step=False):
+# ---- Popularity counters ---- #
+
+# Variants of a popularity field are counted with Space-Saving summaries of capacity counters,
+# one per day, so free-form values like time zones do not grow a day without bound. Counts are
+# exact until a summary has 2 * capacity variants, then it is pruned to the capacity most popular
+# ones and floor keeps the largest dropped count: variants counted again start from it, so counts
+# never underestimate and overestimate by at most floor. Variants more popular than floor are
+# never dropped, and floor stays far below the counts of the most popular variants of skewed
+# fields like time zones. A None capacity counts every variant exactly.
+
+def new_popularity_counter(capacity):
+	return {"counts": {}, "floor": 0, "capacity": capacity}
+
+
+def prune_popularity_counter(counter):
+	# Keep the capacity most popular variants
+	counts = counter["counts"]
+	capacity = counter["capacity"]
+	if capacity is None or len(counts) <= capacity:
+		return
+	ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+	counter["floor"] = max(counter["floor"], ranked[capacity][1])
+	counter["counts"] = dict(ranked[:capacity])
+
+
+def merge_popularity_counters(counter, other):
+	# Add up counts, a variant missing from a pruned counter may have up to its floor
+	counts = counter["counts"]
+	for variant in counts.keys() - other["counts"].keys():
+		counts[variant] += other["floor"]
+	for variant, count in other["counts"].items():
+		counts[variant] = counts.get(variant, counter["floor"]) + count
+	counter["floor"] += other["floor"]
+	prune_popularity_counter(counter)
+
+
+def get_popular_variants(counter):
+	# Get (variants, counts) by popularity, at most capacity of them
+	keys, values = sort_and_unpack_popularity_dictionary(counter["counts"])
+	return keys[:counter["capacity"]], values[:counter["capacity"]]
+
+
+# Counters are kept per day, so the report window is applied when the report is generated
+# and a different window does not need the state to be rebuilt. The price is that memory and
+# state.json grow with the days of history: every day keeps up to 2 * capacity variants per
+# field, in practice the variants seen that day, so the bound per field is days * 2 * capacity
+# and not 2 * capacity. Merging the days of a window adds up their floors, a variant is
+# overestimated by at most the sum of the floors of the merged days, which is 0 for days
+# that never reached 2 * capacity variants.
+
+def get_popularity_capacities(definition):
+	return {chart["field"]: chart.get("capacity", POPULARITY_CAPACITY) for chart in definition["popularity"]}
+
+
+def get_day_counter(counters_per_day, day, capacity):
+	if day not in counters_per_day:
+		counters_per_day[day] = new_popularity_counter(capacity)
+	return counters_per_day[day]
+
+
+def merge_popularity_per_day(counters_per_day, capacity, start_time, end_time):
+	# Merge { day: counter } of days inside [start_time, end_time) into one counter
+	counter = new_popularity_counter(capacity)
+	first_day = get_first_time_bucket(start_time, DAY_STEP)
+	last_day = get_first_time_bucket(end_time, DAY_STEP)
+	for day, day_counter in counters_per_day.items():
+		if first_day <= day < last_day:
+			merge_popularity_counters(counter, day_counter)
+	return counter
+
 
-	graph_data = []
-	start_times = []
+# ---- Streaming aggregation ---- #
+
+INT64_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def normalize_frames(batches):
+	# Parse unixTime to int, frames without a valid unixTime are dropped
+	for frames in batches:
+		normalized = []
+		for frame in frames:
+			try:
+				unix_time = int(frame["unixTime"])
+			except (TypeError, ValueError):
+				continue
+			if unix_time not in INT64_RANGE:
+				continue
+			frame["unixTime"] = unix_time
+			normalized.append(frame)
+		count_items("frames_accepted", len(normalized))
+		count_items("frames_without_unix_time", len(frames) - len(normalized))
+		yield normalized
+
+
+def add_text_feedback(feedback_per_day, frames):
+	# Collect feedback lines as { day: [ line ] }, the report window is applied by report_text_reviews
+	for data_frame in frames:
+		if data_frame.get("statementType") == "userFeedbackFormWith5StarRatingAndText":
+			unix_time = data_frame["unixTime"]
+
+			# Sanitize text: force single-line review
+			text = str(data_frame.get("text", "")).replace("\n", " ").replace("\r", " ").strip()
+
+			line = f"{unix_time} | {data_frame.get('appVersion')} | {data_frame.get('installationId')} | {text}"
+
+			day = get_time_buckets(unix_time, DAY_STEP)
+			if day not in feedback_per_day:
+				feedback_per_day[day] = []
+			feedback_per_day[day].append(line + "\n")
+	return feedback_per_day
+
+
+def add_popularity(popularity, frames, capacities, device_types):
+	# Count variants of popularity fields of new installations per day as { field: { day: counter } },
+	# fields other than deviceType are counted for known device types only
+	for frame in frames:
+		if (("statementType" not in frame) or ("deviceType" not in frame) or
+				(frame["statementType"] != "newInstallationLaunchReport")):
+			continue # Skip non newInstallationLaunchReport types
+
+		day = get_time_buckets(frame["unixTime"], DAY_STEP)
+
+		# Process platforms
+		counter = get_day_counter(popularity["deviceType"], day, capacities["deviceType"])
+		count_popularity_of_statement_variants(frame, counter, "deviceType")
+
+		# Process by platform
+		if frame.get("deviceType") in device_types:
+			for field in popularity:
+				if field != "deviceType":
+					counter = get_day_counter(popularity[field], day, capacities[field])
+					count_popularity_of_statement_variants(frame, counter, field)
+	return popularity
+
+
+def new_aggregate_user_actions(definition):
+	routes = get_statement_routes(definition)
+	if DISTINCT_COUNTING == "hll":
+		return new_sketched_user_actions(routes, get_installation_statements(definition), HLL_PRECISION)
+	return new_user_actions(routes)
+
+
+def new_report_aggregates(definition):
+	return {
+		"definition": definition,
+		"categories": {},
+		"user_actions": new_aggregate_user_actions(definition),
+		"ratings": {},
+		"usage": new_usage_reports(),
+		"feedback": {},
+		"popularity": {chart["field"]: {} for chart in definition["popularity"]},
+	}
+
+
+def new_app_aggregates():
+	# Get report aggregates of every app as { appName: aggregates }
+	return {app_name: new_report_aggregates(definition) for app_name, definition in REPORTS.items()}
+
+
+def add_frames(aggregates, frames):
+	categories = aggregates["categories"]
+	add_user_actions(aggregates["user_actions"], frames, categories)
+	add_ratings(aggregates["ratings"], frames)
+	add_usage_reports(aggregates["usage"], frames, categories)
+	add_text_feedback(aggregates["feedback"], frames)
+	definition = aggregates["definition"]
+	add_popularity(aggregates["popularity"], frames, get_popularity_capacities(definition), definition["device_types"])
+
+
+def aggregate_frames(batches, app_aggregates=None):
+	# Route every batch of normalized frames into the report aggregates of their apps as it arrives,
+	# so only aggregate state is kept and never the whole list of frames, and every app
+	# gets its report from the same single pass
+	app_aggregates = new_app_aggregates() if app_aggregates is None else app_aggregates
+	for frames in batches:
+		frames_per_app = {}
+		for frame in frames:
+			frames_per_app.setdefault(frame.get("appName"), []).append(frame)
+		for app_name, app_frames in frames_per_app.items():
+			aggregates = app_aggregates.get(app_name)
+			if aggregates is not None:
+				add_frames(aggregates, app_frames)
+	for aggregates in app_aggregates.values():
+		if "sketches" not in aggregates["user_actions"]:
+			aggregates["user_actions"] = sort_user_actions(aggregates["user_actions"])
+	return app_aggregates
+
+
+def aggregate_telemetry(app_aggregates=None, telemetry_source=None, filenames=None, rejected_counts=None,
+		reset_event_store=True):
+	# Stream telemetry files into aggregates, loading frames into the event store on the way
+	batches = normalize_frames(stream_telemetry_data(
+		telemetry_source, rejected_counts=rejected_counts, filenames=filenames))
+	event_store = None
+	if EVENT_STORE is not None:
+		event_store = open_event_store(EVENT_STORE, reset_event_store)
+		batches = store_frames(batches, event_store)
+
+	app_aggregates = aggregate_frames(batches, app_aggregates)
+	if event_store is not None:
+		index_event_store(event_store)
+		event_store.close()
+	return app_aggregates
+
+
+# ---- SQLite event store ---- #
+
+# Typed columns of the events table, other fields go to the "extra" JSON column
+EVENT_STORE_COLUMNS = [
+	("unixTime", "INTEGER"), ("installationId", "TEXT"), ("appName", "TEXT"), ("appVersion", "TEXT"),
+	("statementType", "TEXT"), ("checkpointName", "TEXT"), ("usedFunctionName", "TEXT"),
+	("deviceType", "TEXT"), ("language", "TEXT"), ("country", "TEXT"), ("timeZone", "TEXT"),
+	("usageTime", "INTEGER"), ("5StarRating", "INTEGER"), ("text", "TEXT"),
+]
+
+
+def open_event_store(path, reset=True):
+	# Open the store, reset recreates the events table to reload it from the frame stream,
+	# otherwise new frames are appended
+	connection = sqlite3.connect(path)
+	connection.execute("PRAGMA journal_mode=WAL")
+	connection.execute("PRAGMA synchronous=NORMAL")
+	columns = ", ".join(f'"{name}" {column_type}' for name, column_type in EVENT_STORE_COLUMNS)
+	with connection:
+		if reset:
+			connection.execute("DROP TABLE IF EXISTS events")
+		connection.execute(f"CREATE TABLE IF NOT EXISTS events ({columns}, extra TEXT)")
+	return connection
+
+
+def to_event_store_value(value):
+	# Bind scalars as they are and everything else as JSON
+	if value is None or isinstance(value, (str, float)):
+		return value
+	if isinstance(value, int) and value in INT64_RANGE:
+		return value
+	return json.dumps(value)
+
+
+def store_frames(batches, connection):
+	# Insert every batch of frames with one executemany and pass the batches on
+	names = [name for name, _ in EVENT_STORE_COLUMNS]
+	typed = set(names)
+	columns = ", ".join(f'"{name}"' for name in names)
+	placeholders = ", ".join("?" for _ in range(len(names) + 1))
+	insert = f"INSERT INTO events ({columns}, extra) VALUES ({placeholders})"
+	for frames in batches:
+		rows = []
+		for frame in frames:
+			extra = {field: value for field, value in frame.items() if field not in typed}
+			rows.append([to_event_store_value(frame.get(name)) for name in names] +
+						[json.dumps(extra) if extra else None])
+		with connection:
+			connection.executemany(insert, rows)
+		yield frames
+
+
+def index_event_store(connection):
+	# Create indexes after the bulk load, it is faster than keeping them up to date while inserting
+	with connection:
+		connection.execute(
+			'CREATE INDEX IF NOT EXISTS events_statement_time ON events ("statementType", "unixTime")')
+		connection.execute(
+			'CREATE INDEX IF NOT EXISTS events_installation_time ON events ("installationId", "unixTime")')
+		for field in ROUTED_FIELDS:
+			if field != "statementType":
+				connection.execute(
+					f'CREATE INDEX IF NOT EXISTS "events_{field}_time" ON events ("{field}", "unixTime")')
+		connection.execute("ANALYZE")
+
+
+def get_statement_field(statement, app_name):
+	# Find which frame field a statement like "secondLaunch" is stored in
+	for field, statements in get_statement_routes(REPORTS[app_name]).items():
+		if statement in statements:
+			return field
+	raise ValueError(f"Unknown statement: {statement}")
+
+
+def sql_count_statements(connection, app_name, statement, start_time, end_time):
+	# count_statements as an indexed query over the event store
+	field = get_statement_field(statement, app_name)
+	query = (f'SELECT COUNT(*) FROM events '
+			 f'WHERE "{field}" = ? AND "unixTime" >= ? AND "unixTime" < ? AND "appName" = ?')
+	return connection.execute(query, (statement, start_time, end_time, app_name)).fetchone()[0]
+
+
+def sql_count_users_with_existent_statement(connection, app_name, statement, start_time, end_time):
+	# count_users_with_existent_statement as an indexed query over the event store
+	field = get_statement_field(statement, app_name)
+	query = (f'SELECT COUNT(DISTINCT "installationId") FROM events '
+			 f'WHERE "{field}" = ? AND "unixTime" >= ? AND "unixTime" < ? AND "appName" = ?')
+	return connection.execute(query, (statement, start_time, end_time, app_name)).fetchone()[0]
+
+
+def get_statement_times(user_actions, statement):
+	# Get all timestamps of a statement as parallel (user code, unixTime) arrays sorted by user and time
+	code = user_actions["statement_codes"].get(statement)
+	if code is None:
+		return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+	first, last = np.searchsorted(user_actions["statements"], [code, code + 1])
+	return user_actions["users"][first:last], user_actions["times"][first:last]
+
+
+# ---- Time buckets ---- #
+
+# Report time is UTC shifted by UTC_OFFSET, bucket n of a time step covers
+# local times [n * time_step, (n + 1) * time_step)
+DAY_STEP = 86400  # 1 day
+
+
+def get_time_buckets(times, time_step):
+	# Map unix times (int or array) to local time bucket indexes with integer arithmetic
+	return (times + UTC_OFFSET) // time_step
+
+
+def get_first_time_bucket(unix_time, time_step):
+	# Get the first bucket starting at or after unix_time
+	return -(-(unix_time + UTC_OFFSET) // time_step)
+
+
+def get_time_bucket_starts(buckets, time_step):
+	# Get unix times of bucket starts
+	return buckets * time_step - UTC_OFFSET
+
+
+def format_time_buckets(buckets, time_step, time_format):
+	# Format a label once per bucket
+	return [datetime.fromtimestamp(bucket * time_step, timezone.utc).strftime(time_format)
+			for bucket in np.asarray(buckets).tolist()]
+
+
+def get_time_axis_label():
+	if UTC_OFFSET == 0:
+		return "Time (UTC)"
+	sign = "+" if UTC_OFFSET > 0 else "-"
+	hours, minutes = divmod(abs(UTC_OFFSET) // 60, 60)
+	return f"Time (UTC{sign}{hours:02d}:{minutes:02d})"
+
+
+# ---- Distinct counting sketches ---- #
+
+# With DISTINCT_COUNTING = "hll" active installations are counted with a HyperLogLog sketch
+# per hour and statement instead of keeping every (hour, installation) pair. A sketch has
+# 2 ** HLL_PRECISION one-byte registers, sketches merge by taking the max of every register,
+# so hours merge into days, weeks or months, and shards merge, without losing accuracy.
+# The relative standard error of a count is 1.04 / sqrt(2 ** HLL_PRECISION): 1.6% at
+# precision 12, so about 95% of counts are within 3.3% of the exact count. Small counts
+# are more accurate than that. Sketches are updated while frames are added, and only
+# statements the report counts installations of are sketched, see get_installation_statements.
+# Retention and funnels need exact activity and are not available with sketches.
+
+def hash_installation(installation_id):
+	# Get a 64-bit hash of an installationId that is the same in every process and shard
+	return int.from_bytes(hashlib.blake2b(str(installation_id).encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def add_to_sketch(sketch, installation_hash, precision):
+	# Add a hash to a sketch of 2 ** precision registers, the first precision bits of the hash
+	# pick a register, which keeps the max position of the first 1 in the other bits
+	rest_bits = 64 - precision
+	register = installation_hash >> rest_bits
+	rank = rest_bits + 1 - (installation_hash & ((1 << rest_bits) - 1)).bit_length()
+	if sketch[register] < rank:
+		sketch[register] = rank
+
+
+def estimate_distinct(sketches):
+	# Estimate distinct counts of sketches along the last axis with the improved estimator of
+	# Ertl (2017), which is unbiased from small to large counts without switching to linear counting
+	registers_count = sketches.shape[-1]
+	max_rank = 64 - registers_count.bit_length() + 2
+	rows = sketches.reshape(-1, registers_count).astype(np.int64)
+	rows += np.arange(len(rows))[:, None] * (max_rank + 1)
+	histograms = np.bincount(rows.ravel(), minlength=len(rows) * (max_rank + 1)).reshape(len(rows), max_rank + 1)
+
+	z = registers_count * estimate_tau(1 - histograms[:, max_rank] / registers_count)
+	for rank in range(max_rank - 1, 0, -1):
+		z = 0.5 * (z + histograms[:, rank])
+	z += registers_count * estimate_sigma(histograms[:, 0] / registers_count)
+	estimates = registers_count ** 2 / (2 * np.log(2)) / z
+	return np.rint(estimates).astype(np.int64).reshape(sketches.shape[:-1])
+
+
+def estimate_sigma(x):
+	# Series of the estimator for empty registers, converged after 64 terms
+	y = 1.0
+	z = x.copy()
+	for _ in range(64):
+		x = x * x
+		z += x * y
+		y += y
+	return z
+
+
+def estimate_tau(x):
+	# Series of the estimator for saturated registers, converged after 64 terms
+	y = 1.0
+	z = 1 - x
+	for _ in range(64):
+		x = np.sqrt(x)
+		y *= 0.5
+		z -= (1 - x) ** 2 * y
+	return z / 3
+
+
+# ---- Rollups ---- #
+
+# Statements, ratings and usage time are aggregated per hour once, so any window
+# or view is built by merging hourly rollups instead of rescanning frames.
+# Windows and time steps are resolved to whole hours.
+ROLLUP_STEP = 3600  # 1 hour
+RATING_VARIANTS = 6  # 0 (invalid rating) to 5 stars
+USAGE_BOUNDARY_KEYS = ["boundary_codes", "boundary_first_times", "boundary_first_usage_times",
+					   "boundary_times", "boundary_usage_times"]
+
+
+def get_rollup_rows(hours, start_time, end_time):
+	# Get the slice of sorted rollup hours inside [start_time, end_time)
+	first = np.searchsorted(hours, get_first_time_bucket(start_time, ROLLUP_STEP))
+	last = np.searchsorted(hours, get_first_time_bucket(end_time, ROLLUP_STEP))
+	return slice(first, last)
+
+
+def build_statement_rollups(user_actions, statements, users_count):
+	# Get { statement: { hours, counts: events per hour, active: sorted unique hour * users_count + user } }
+	rollups = {}
+	for statement in statements:
+		users, times = get_statement_times(user_actions, statement)
+		hours = get_time_buckets(times, ROLLUP_STEP)
+		event_hours, counts = np.unique(hours, return_counts=True)
+		rollups[statement] = {"hours": event_hours, "counts": counts,
+							  "active": np.unique(hours * users_count + users)}
+	return rollups
+
+
+def build_sketched_statement_rollups(user_actions):
+	# Get { statement: { hours, counts: events per hour } } of sketched user actions,
+	# sketched statements also get their sketches of active installations as [hour][register]
+	# Sketches are moved out of the user actions, so they are not kept twice
+	statement_codes = user_actions["statement_codes"]
+	statements_count = len(statement_codes)
+	counts = user_actions["counts"]
+	keys = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+	values = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+	order = np.argsort(keys)
+	keys = keys[order]
+	values = values[order]
+	codes = keys % statements_count
+
+	rollups = {}
+	for statement, code in statement_codes.items():
+		is_statement = codes == code
+		rollups[statement] = {"hours": keys[is_statement] // statements_count, "counts": values[is_statement]}
+		if code in user_actions["sketched"]:
+			statement_keys = keys[is_statement].tolist()
+			sketches = np.empty((len(statement_keys), 1 << user_actions["precision"]), dtype=np.uint8)
+			for row, key in enumerate(statement_keys):
+				sketches[row] = np.frombuffer(user_actions["sketches"].pop(key), dtype=np.uint8)
+			rollups[statement]["sketches"] = sketches
+	return rollups
+
+
+def add_ratings(ratings, frames):
+	# Count 5 star ratings as { hour * RATING_VARIANTS + stars: count }, 0 stars means invalid rating
+	for data_frame in frames:
+		if data_frame.get("statementType") != "userFeedbackFormWith5StarRatingAndText":
+			continue
+
+		# Parse rating
+		try:
+			rating = int(data_frame.get("5StarRating"))
+			if rating < 1 or rating > 5:
+				rating = 0
+		except (TypeError, ValueError):
+			rating = 0
+
+		key = get_time_buckets(data_frame["unixTime"], ROLLUP_STEP) * RATING_VARIANTS + rating
+		ratings[key] = ratings.get(key, 0) + 1
+	return ratings
+
+
+def build_rating_rollups(ratings):
+	# Get 5 star rating histograms per hour as { hours, counts: [hour][stars] }
+	keys = np.fromiter(ratings.keys(), dtype=np.int64, count=len(ratings))
+	counts = np.fromiter(ratings.values(), dtype=np.int64, count=len(ratings))
+	hours, rows = np.unique(keys // RATING_VARIANTS, return_inverse=True)
+	histograms = np.zeros((len(hours), RATING_VARIANTS), dtype=np.int64)
+	histograms[rows, keys % RATING_VARIANTS] = counts
+	return {"hours": hours, "counts": histograms}
+
+
+def new_usage_reports():
+	return {"codes": array("q"), "times": array("q"), "usage_times": array("q")}
+
+
+def add_usage_reports(usage_reports, frames, categories):
+	# Collect sixHoursUsageTimeReport as compact (installation code, unixTime, usageTime) columns
+	for data_frame in frames:
+		if data_frame.get("statementType") != "sixHoursUsageTimeReport":
+			continue
+
+		try:
+			usage_time = int(data_frame.get("usageTime"))
+		except (TypeError, ValueError):
+			continue
+		if usage_time not in INT64_RANGE:
+			continue
+
+		code = get_category_code(categories, "installationId", data_frame.get("installationId"))
+		usage_reports["codes"].append(code)
+		usage_reports["times"].append(data_frame["unixTime"])
+		usage_reports["usage_times"].append(usage_time)
+	return usage_reports
+
+
+def get_usage_deltas(usage_reports):
+	# Get (unixTime, delta) arrays of positive usage time deltas between consecutive
+	# sixHoursUsageTimeReport of each installation, plus the first and last report of each
+	# installation as boundary_*, so deltas can continue across merged rollups
+	installations = np.frombuffer(usage_reports["codes"], dtype=np.int64)
+	times = np.frombuffer(usage_reports["times"], dtype=np.int64)
+	usage_times = np.frombuffer(usage_reports["usage_times"], dtype=np.int64)
+
+	# Sort reports by installation, then by time
+	order = np.lexsort((times, installations))
+	installations = installations[order]
+	times = times[order]
+	usage_times = usage_times[order]
+
+	# The first report of each installation is a baseline, we cannot know how much was used before it,
+	# and negative deltas are corrupted / reset cases
+	deltas = np.diff(usage_times)
+	is_same = installations[1:] == installations[:-1]
+	is_valid = is_same & (deltas > 0)
+
+	# Keep the first and last report of each installation
+	is_first = np.insert(~is_same, 0, True)[:len(installations)]
+	is_last = np.append(~is_same, True)[:len(installations)]
+	boundary = {
+		"boundary_codes": installations[is_last],
+		"boundary_first_times": times[is_first],
+		"boundary_first_usage_times": usage_times[is_first],
+		"boundary_times": times[is_last],
+		"boundary_usage_times": usage_times[is_last],
+	}
+	return times[1:][is_valid], deltas[is_valid], boundary
+
+
+def is_usage_after_boundary(usage_reports, boundary, users_count):
+	# Deltas can continue from a boundary only when no new report of an installation is older than its last one
+	last_times = np.full(users_count, np.iinfo(np.int64).min, dtype=np.int64)
+	last_times[boundary["boundary_codes"]] = boundary["boundary_times"]
+	codes = np.frombuffer(usage_reports["codes"], dtype=np.int64)
+	times = np.frombuffer(usage_reports["times"], dtype=np.int64)
+	return bool(np.all(times >= last_times[codes]))
+
+
+def sum_per_hour(times, values):
+	# Get (hours, sums of values per hour) of values at unixTimes
+	hours, rows = np.unique(get_time_buckets(times, ROLLUP_STEP), return_inverse=True)
+	return hours, np.bincount(rows, weights=values, minlength=len(hours)).astype(np.int64)
+
+
+def build_usage_rollups(usage_reports):
+	# Get usage time per hour as { hours, seconds } plus the boundary_* reports per installation
+	times, deltas, boundary = get_usage_deltas(usage_reports)
+	hours, seconds = sum_per_hour(times, deltas)
+	return {"hours": hours, "seconds": seconds, **boundary}
+
+
+def build_lifetime_rollups(user_actions, users_count):
+	# Get first and last sixHoursActivityReport time and the report count per user code
+	if "sketches" in user_actions:
+		user_times = user_actions["lifetime"]
+		codes = np.fromiter(user_times.keys(), dtype=np.int64, count=len(user_times))
+		first_times, last_times, counts = np.array(list(user_times.values()), dtype=np.int64).reshape(-1, 3).T
+	else:
+		users, times = get_statement_times(user_actions, "sixHoursActivityReport")
+		codes, first, counts = np.unique(users, return_index=True, return_counts=True)
+		first_times = times[first]
+		last_times = times[first + counts - 1]
+	lifetime = {
+		"first": np.full(users_count, np.iinfo(np.int64).max, dtype=np.int64),
+		"last": np.full(users_count, np.iinfo(np.int64).min, dtype=np.int64),
+		"counts": np.zeros(users_count, dtype=np.int64),
+	}
+	lifetime["first"][codes] = first_times
+	lifetime["last"][codes] = last_times
+	lifetime["counts"][codes] = counts
+	return lifetime
+
+
+def build_rollups(aggregates):
+	user_actions = aggregates["user_actions"]
+	users_count = max(1, len(aggregates["categories"].get("installationId", ())))
+	if "sketches" in user_actions:
+		statements = build_sketched_statement_rollups(user_actions)
+	else:
+		statements = build_statement_rollups(user_actions, user_actions["statement_codes"], users_count)
+	return {
+		"users_count": users_count,
+		"statements": statements,
+		"ratings": build_rating_rollups(aggregates["ratings"]),
+		"usage": build_usage_rollups(aggregates["usage"]),
+		"lifetime": build_lifetime_rollups(user_actions, users_count),
+	}
+
+
+def merge_hourly_rollups(hours, values, other_hours, other_values, merge=np.add):
+	# Add up values of two hourly rollups, values may be rows like rating histograms,
+	# merge=np.maximum merges sketches
+	merged_hours, rows = np.unique(np.concatenate([hours, other_hours]), return_inverse=True)
+	merged_values = np.zeros((len(merged_hours),) + values.shape[1:], dtype=values.dtype)
+	merge.at(merged_values, rows, np.concatenate([values, other_values]))
+	return merged_hours, merged_values
+
+
+def rebase_active_keys(keys, users_count, new_users_count):
+	# Re-encode hour * users_count + user keys for a larger users_count, order is kept
+	return keys // users_count * new_users_count + keys % users_count
+
+
+def pad_user_rollup(values, users_count, fill_value):
+	padded = np.full(users_count, fill_value, dtype=np.int64)
+	padded[:len(values)] = values
+	return padded
+
+
+def merge_usage_boundaries(boundary, other):
+	# Continue usage deltas of installations reported in both rollups, from the last report of
+	# the earlier rollup to the first report of the later one
+	# Returns (unixTime, delta) arrays of those deltas and the merged boundary_* reports
+	reports = {key: np.concatenate([boundary[key], other[key]]) for key in USAGE_BOUNDARY_KEYS}
+	codes = reports["boundary_codes"]
+	by_first = np.lexsort((reports["boundary_first_times"], codes))
+	by_last = np.lexsort((reports["boundary_times"], codes))
+	codes = codes[by_first]
+	is_same = codes[1:] == codes[:-1]
+
+	# Rollups of one installation covering overlapping times cannot be continued, their deltas
+	# were taken between reports that are not consecutive
+	last_times = reports["boundary_times"][by_first]
+	first_times = reports["boundary_first_times"][by_first]
+	is_after = last_times[:-1] <= first_times[1:]
+	overlapping = len(np.unique(codes[1:][is_same & ~is_after]))
+	if overlapping:
+		print(f"Usage reports of {overlapping} installations overlap in time between merged reports, "
+			  f"their usage time is approximate, split shards by time or by installation")
+		count_items("usage_overlapping_installations", overlapping)
+
+	deltas = reports["boundary_first_usage_times"][by_first][1:] - reports["boundary_usage_times"][by_first][:-1]
+	is_valid = is_same & is_after & (deltas > 0)
+
+	# Keep the first and last report of each installation
+	is_first = np.insert(~is_same, 0, True)[:len(codes)]
+	is_last = np.append(~is_same, True)[:len(codes)]
+	merged = {"boundary_codes": codes[is_first]}
+	for key in ["boundary_first_times", "boundary_first_usage_times"]:
+		merged[key] = reports[key][by_first][is_first]
+	for key in ["boundary_times", "boundary_usage_times"]:
+		merged[key] = reports[key][by_last][is_last]
+	return first_times[1:][is_valid], deltas[is_valid], merged
+
+
+def merge_rollups(rollups, other):
+	# Merge rollups built from different frames with shared installation codes
+	users_count = max(rollups["users_count"], other["users_count"])
+
+	statements = {}
+	for statement, rollup in rollups["statements"].items():
+		other_rollup = other["statements"][statement]
+		hours, counts = merge_hourly_rollups(
+			rollup["hours"], rollup["counts"], other_rollup["hours"], other_rollup["counts"])
+		statements[statement] = {"hours": hours, "counts": counts}
+		if "sketches" in rollup:
+			_, statements[statement]["sketches"] = merge_hourly_rollups(
+				rollup["hours"], rollup["sketches"], other_rollup["hours"], other_rollup["sketches"], np.maximum)
+		elif "active" in rollup:
+			statements[statement]["active"] = np.union1d(
+				rebase_active_keys(rollup["active"], rollups["users_count"], users_count),
+				rebase_active_keys(other_rollup["active"], other["users_count"], users_count))
+
+	ratings = rollups["ratings"]
+	other_ratings = other["ratings"]
+	rating_hours, rating_counts = merge_hourly_rollups(
+		ratings["hours"], ratings["counts"], other_ratings["hours"], other_ratings["counts"])
+
+	# Add the usage deltas between the two rollups
+	usage = rollups["usage"]
+	other_usage = other["usage"]
+	usage_hours, seconds = merge_hourly_rollups(
+		usage["hours"], usage["seconds"], other_usage["hours"], other_usage["seconds"])
+	bridge_times, bridge_deltas, boundary = merge_usage_boundaries(usage, other_usage)
+	usage_hours, seconds = merge_hourly_rollups(usage_hours, seconds, *sum_per_hour(bridge_times, bridge_deltas))
+
+	lifetime = rollups["lifetime"]
+	other_lifetime = other["lifetime"]
+	int64_info = np.iinfo(np.int64)
+	return {
+		"users_count": users_count,
+		"statements": statements,
+		"ratings": {"hours": rating_hours, "counts": rating_counts},
+		"usage": {"hours": usage_hours, "seconds": seconds, **boundary},
+		"lifetime": {
+			"first": np.minimum(pad_user_rollup(lifetime["first"], users_count, int64_info.max),
+								pad_user_rollup(other_lifetime["first"], users_count, int64_info.max)),
+			"last": np.maximum(pad_user_rollup(lifetime["last"], users_count, int64_info.min),
+							   pad_user_rollup(other_lifetime["last"], users_count, int64_info.min)),
+			"counts": (pad_user_rollup(lifetime["counts"], users_count, 0) +
+					   pad_user_rollup(other_lifetime["counts"], users_count, 0)),
+		},
+	}
+
+
+def count_statements(rollups, statement, start_time, end_time):
+	# Count particular statements like "statementType": "sixHoursActivityReport" in a window
+	rollup = rollups["statements"].get(statement)
+	if rollup is None:
+		return 0
+	return int(rollup["counts"][get_rollup_rows(rollup["hours"], start_time, end_time)].sum())
+
+
+def count_users_with_existent_statement(rollups, statement, start_time, end_time):
+	# Count users who have at least one particular statement in a window
+	rollup = rollups["statements"].get(statement)
+	if rollup is None:
+		return 0
+	if "sketches" in rollup:
+		rows = get_rollup_rows(rollup["hours"], start_time, end_time)
+		return int(estimate_distinct(rollup["sketches"][rows].max(axis=0, initial=0)))
+	_, users = get_active_users(rollups, statement, start_time, end_time)
+	return len(np.unique(users))
+
+
+def get_active_users(rollups, statement, start_time, end_time):
+	# Get (hours, users) with a particular statement in a window, sorted by hour, then user
+	# None when active installations are counted with sketches
+	rollup = rollups["statements"].get(statement)
+	if rollup is None:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	if "active" not in rollup:
+		return None
+	users_count = rollups["users_count"]
+	keys = rollup["active"]
+	first = np.searchsorted(keys, get_first_time_bucket(start_time, ROLLUP_STEP) * users_count)
+	last = np.searchsorted(keys, get_first_time_bucket(end_time, ROLLUP_STEP) * users_count)
+	keys = keys[first:last]
+	return keys // users_count, keys % users_count
+
+
+def count_statements_per_time_steps(
+		rollups, statement, start_time, end_time, time_step, count_mode="events"):
+	# Count statements in every [start, start + time_step) frame from start_time to end_time at once
+	# count_mode: "events" counts every statement, "installations" counts each user once per frame
+	steps_count = max(0, -(-(end_time - start_time) // time_step))
+	rollup = rollups["statements"].get(statement)
+	if rollup is None:
+		return np.zeros(steps_count, dtype=np.int64)
+
+	if count_mode == "events" or "sketches" in rollup:
+		hours = rollup["hours"]
+	elif count_mode == "installations":
+		users_count = rollups["users_count"]
+		hours = rollup["active"] // users_count
+	else:
+		raise ValueError(f"Unknown count mode: {count_mode}")
+
+	# Map hours to time frame indexes and drop the ones outside of frames
+	times = get_time_bucket_starts(hours, ROLLUP_STEP)
+	steps = (times - start_time) // time_step
+	in_frames = (times >= start_time) & (steps < steps_count)
+
+	if count_mode == "events":
+		counts = np.bincount(steps[in_frames], weights=rollup["counts"][in_frames], minlength=steps_count)
+		return counts.astype(np.int64)
+
+	# Merge sketches of the hours of every frame, hours are sorted so frames are consecutive rows
+	if "sketches" in rollup:
+		counts = np.zeros(steps_count, dtype=np.int64)
+		frames, first_rows = np.unique(steps[in_frames], return_index=True)
+		if len(frames):
+			sketches = np.maximum.reduceat(rollup["sketches"][in_frames], first_rows, axis=0)
+			counts[frames] = estimate_distinct(sketches)
+		return counts
+
+	# Keep one (user, frame) pair per user
+	users = rollup["active"][in_frames] % users_count
+	steps = np.unique(users * steps_count + steps[in_frames]) % steps_count
+	return np.bincount(steps, minlength=steps_count)
+
+
+def calculate_graph_data_by_statements_count_per_time(
+		rollups, statement, start_time, end_time, time_step, is_max_one_per_time_step=False):
 
 	# Check
 	if end_time <= start_time:
-		println("ERROR in create_graph: incorrect time")
-
-	# Create time steps
-	time = start_time
-	while time < end_time:
-		start_times.append(time)
-		time += time_step
+		print("ERROR in create_graph: incorrect time")
+		return []
 
 	# Get count for time frames
-	for start in start_times:
-		graph_data.append(count_statements_per_time_frame(
-			user_actions, statement, start, start + time_step, is_max_one_per_time_step))
+	count_mode = "installations" if is_max_one_per_time_step else "events"
+	return count_statements_per_time_steps(
+		rollups, statement, start_time, end_time, time_step, count_mode).tolist()
+
+
+def sum_rollups_per_day(hours, values, start_time, end_time):
+	# Merge hourly rollup values inside a window into (days, values per day)
+	rows = get_rollup_rows(hours, start_time, end_time)
+	values = values[rows]
+	days, first_rows = np.unique(hours[rows] * ROLLUP_STEP // DAY_STEP, return_index=True)
+	if not len(days):
+		return days, values
+	return days, np.add.reduceat(values, first_rows)
+
+
+# ---- Retention ---- #
+
+# Retention and funnels are built from the exact activity keys of the rollups, so they
+# need DISTINCT_COUNTING = "exact". Days are report days (UTC_OFFSET), day N of an
+# installation is N days after the day of its first sixHoursActivityReport.
+WEEK_START_SHIFT = 3  # Day 0 of unix time is a Thursday, shift weeks to start on Monday
+
+
+def build_retention(rollups, start_time, end_time):
+	# Get activity days of installations first active inside the window as
+	# { first_days: per user code, users, day_n: (user, day N) pairs active, last_day }
+	# None when active installations are counted with sketches
+	active = get_active_users(rollups, "sixHoursActivityReport", start_time, end_time)
+	if active is None:
+		return None
+	hours, users = active
+
+	# First seen over the whole history, not only inside the window
+	lifetime = rollups["lifetime"]
+	first_times = lifetime["first"]
+	is_new = (lifetime["counts"] > 0) & (first_times >= start_time) & (first_times < end_time)
+	first_days = np.where(is_new, get_time_buckets(np.where(is_new, first_times, 0), DAY_STEP), -1)
+
+	# One pair per user and day
+	days = hours * ROLLUP_STEP // DAY_STEP
+	keep = is_new[users]
+	pairs = np.unique(days[keep] * rollups["users_count"] + users[keep])
+	days = pairs // rollups["users_count"]
+	users = pairs % rollups["users_count"]
+	return {
+		"first_days": first_days,
+		"users": users,
+		"day_n": days - first_days[users],
+		"last_day": int(days.max()) if len(days) else -1,
+	}
+
+
+def get_cohort_start_days(days, cohort_days):
+	# Get the first day of the day (1) or week (7) cohort of days
+	if cohort_days == 7:
+		return days - (days + WEEK_START_SHIFT) % 7
+	return days
+
+
+def get_retention_matrix(retention, cohort_days, max_day_n):
+	# Get (cohort start days, installations per cohort, [cohort][day N] active installations)
+	# Days N not over yet for every installation of a cohort are -1
+	first_days = retention["first_days"]
+	new_users = np.flatnonzero(first_days >= 0)
+	cohorts, rows = np.unique(get_cohort_start_days(first_days[new_users], cohort_days), return_inverse=True)
+	user_rows = np.full(len(first_days), -1, dtype=np.int64)
+	user_rows[new_users] = rows
+
+	day_n = retention["day_n"]
+	in_range = day_n <= max_day_n
+	columns = max_day_n + 1
+	matrix = np.bincount(user_rows[retention["users"][in_range]] * columns + day_n[in_range],
+						 minlength=len(cohorts) * columns).reshape(len(cohorts), columns)
+
+	is_over = (cohorts + cohort_days - 1)[:, None] + np.arange(columns) <= retention["last_day"]
+	return cohorts, np.bincount(rows, minlength=len(cohorts)), np.where(is_over, matrix, -1)
+
+
+def get_retention_curve(retention, max_day_n):
+	# Get the share of installations active on day N, of installations whose day N is over
+	first_days = np.sort(retention["first_days"][retention["first_days"] >= 0])
+	day_n = retention["day_n"]
+	active = np.bincount(day_n[day_n <= max_day_n], minlength=max_day_n + 1)
+	installations = np.searchsorted(first_days, retention["last_day"] - np.arange(max_day_n + 1), side="right")
+	return np.where(installations > 0, active / np.maximum(installations, 1), 0)
+
+
+def get_funnel(rollups, checkpoints, start_time, end_time):
+	# Get installations in a window reaching newInstallationLaunchReport and then every checkpoint
+	# in order, by the hour each was first reached, as counts per step
+	# None when active installations are counted with sketches
+	not_reached = np.iinfo(np.int64).max
+	reached_hours = None
+	counts = []
+	for statement in ["newInstallationLaunchReport", *checkpoints]:
+		active = get_active_users(rollups, statement, start_time, end_time)
+		if active is None:
+			return None
+		hours, users = active
+		first_hours = np.full(rollups["users_count"], not_reached, dtype=np.int64)
+		codes, first = np.unique(users, return_index=True)
+		first_hours[codes] = hours[first]
+
+		if reached_hours is not None:
+			is_reached = (reached_hours != not_reached) & (first_hours >= reached_hours)
+			first_hours = np.where(is_reached, first_hours, not_reached)
+		reached_hours = first_hours
+		counts.append(int(np.count_nonzero(reached_hours != not_reached)))
+	return counts
+
+
+# ---- Report state ---- #
+
+# The report is generated from a state of rollups, feedback and popularity counters
+# persisted together with the (size, mtime or CRC) of every file folded into it.
+# Reruns fold in only files added since, the state is rebuilt from all files when
+# a folded file changed or disappeared or the report config changed.
+# State layout (per telemetry source):
+#   state.json         version, config, folded files, rejected counts, per app users, feedback, popularity
+#   rollups.npz        rollup arrays keyed by app name and their path in the rollups dict
+REPORT_STATE_VERSION = 5
+
+
+def get_report_state_dir(telemetry_source):
+	return get_frame_cache_dir(telemetry_source) + "_report_state"
+
+
+def get_report_config(telemetry_source):
+	# Settings the state depends on, the report window is applied when the report is generated
+	return {
+		"source": os.path.abspath(telemetry_source),
+		"utc_offset": UTC_OFFSET,
+		"reports": REPORTS,
+		"event_store": EVENT_STORE,
+		"distinct_counting": DISTINCT_COUNTING,
+		"hll_precision": HLL_PRECISION,
+		"popularity_capacity": POPULARITY_CAPACITY,
+	}
+
+
+def build_report_state(aggregates):
+	# Reduce aggregates to what the report is generated from
+	return {
+		"users": list(aggregates["categories"].get("installationId", {})),
+		"rollups": build_rollups(aggregates),
+		"feedback": aggregates["feedback"],
+		"popularity": aggregates["popularity"],
+	}
+
+
+def build_report_states(app_aggregates):
+	return {app_name: build_report_state(aggregates) for app_name, aggregates in app_aggregates.items()}
+
+
+def new_report_state(config):
+	return {
+		"config": config,
+		"files": {},
+		"rejected": {category: 0 for category in REJECT_CATEGORIES},
+		"reports": build_report_states(aggregate_frames([])),
+	}
+
+
+def fold_report_state(state, app_aggregates):
+	# Fold aggregates of new frames of every app into the state, they must share its installation codes
+	# Returns False when usage deltas cannot continue from the state and it has to be rebuilt
+	for app_name, aggregates in app_aggregates.items():
+		boundary = state["reports"][app_name]["rollups"]["usage"]
+		users_count = max(1, len(aggregates["categories"].get("installationId", ())))
+		if not is_usage_after_boundary(aggregates["usage"], boundary, users_count):
+			return False
+
+	for app_name, aggregates in app_aggregates.items():
+		fold_report(state["reports"][app_name], aggregates)
+	return True
+
+
+def fold_report(report, aggregates):
+	report["rollups"] = merge_rollups(report["rollups"], build_rollups(aggregates))
+	report["users"] = list(aggregates["categories"].get("installationId", {}))
+	merge_feedback_and_popularity(report, aggregates["feedback"], aggregates["popularity"])
+
+
+def merge_feedback_and_popularity(report, feedback, popularity):
+	for day, lines in feedback.items():
+		report["feedback"].setdefault(day, []).extend(lines)
+	for field, counters_per_day in popularity.items():
+		report_counters = report["popularity"][field]
+		for day, counter in counters_per_day.items():
+			if day in report_counters:
+				merge_popularity_counters(report_counters[day], counter)
+			else:
+				report_counters[day] = counter
+
+
+def remap_rollups(rollups, codes, users_count):
+	# Re-encode installation codes of rollups, codes[code] is the new code of an installation
+	# among users_count installations
+	old_users_count = rollups["users_count"]
+	statements = {}
+	for statement, rollup in rollups["statements"].items():
+		statements[statement] = dict(rollup)
+
+		# Sketches hash installationIds and do not depend on codes
+		if "active" in rollup:
+			active = rollup["active"]
+			statements[statement]["active"] = np.unique(
+				active // old_users_count * users_count + codes[active % old_users_count])
+
+	usage = dict(rollups["usage"])
+	usage["boundary_codes"] = codes[usage["boundary_codes"]]
+
+	int64_info = np.iinfo(np.int64)
+	lifetime = {}
+	for key, fill_value in [("first", int64_info.max), ("last", int64_info.min), ("counts", 0)]:
+		lifetime[key] = np.full(users_count, fill_value, dtype=np.int64)
+		lifetime[key][codes] = rollups["lifetime"][key][:len(codes)]
+
+	return {
+		"users_count": users_count,
+		"statements": statements,
+		"ratings": rollups["ratings"],
+		"usage": usage,
+		"lifetime": lifetime,
+	}
+
+
+def merge_report(report, other):
+	# Merge the report of other files with their own installation codes into report
+	categories = {"installationId": {user: code for code, user in enumerate(report["users"])}}
+	codes = np.array([get_category_code(categories, "installationId", user) for user in other["users"]],
+					 dtype=np.int64)
+	report["users"] = list(categories["installationId"])
+	users_count = max(1, len(report["users"]))
+	report["rollups"] = merge_rollups(report["rollups"], remap_rollups(other["rollups"], codes, users_count))
+	merge_feedback_and_popularity(report, other["feedback"], other["popularity"])
+
+
+def merge_report_states(states, config):
+	# Reduce report states of disjoint shards of the telemetry files into one state,
+	# the states must be built with config, apart from their source
+	merged = new_report_state(dict(config, source=None))
+	for state in states:
+		source = state["config"]["source"]
+		if dict(state["config"], source=None) != merged["config"]:
+			raise ValueError(f"Report state of {source} was built with a different config")
+		for filename, stat in state["files"].items():
+			merged["files"][os.path.join(source, filename)] = stat
+		for category, count in state["rejected"].items():
+			merged["rejected"][category] += count
+		for app_name, report in state["reports"].items():
+			merge_report(merged["reports"][app_name], report)
+	return merged
+
+
+def flatten_arrays(tree, prefix=""):
+	# Get { "path/to/key": array } of a nested dict of arrays
+	arrays = {}
+	for key, value in tree.items():
+		if isinstance(value, dict):
+			arrays.update(flatten_arrays(value, f"{prefix}{key}/"))
+		else:
+			arrays[prefix + key] = np.asarray(value)
+	return arrays
+
+
+def unflatten_arrays(arrays):
+	tree = {}
+	for path, value in arrays.items():
+		*parents, key = path.split("/")
+		node = tree
+		for parent in parents:
+			node = node.setdefault(parent, {})
+		node[key] = value.item() if value.ndim == 0 else value
+	return tree
+
+
+def load_report_state(state_dir):
+	try:
+		with open(os.path.join(state_dir, "state.json"), "r", encoding="utf-8") as f:
+			meta = json.load(f)
+		if meta.get("version") != REPORT_STATE_VERSION:
+			return None
+		with np.load(os.path.join(state_dir, "rollups.npz")) as arrays:
+			rollups = unflatten_arrays(dict(arrays))
+		reports = {}
+		for app_name, report in meta["reports"].items():
+			reports[app_name] = {
+				"users": report["users"],
+				"rollups": rollups[app_name],
+				"feedback": {day: lines for day, lines in report["feedback"]},
+				"popularity": {field: {day: dict(counter, counts={value: count for value, count in counter["counts"]})
+									   for day, counter in counters_per_day}
+							   for field, counters_per_day in report["popularity"].items()},
+			}
+		return {
+			"config": meta["config"],
+			"files": meta["files"],
+			"rejected": meta["rejected"],
+			"reports": reports,
+		}
+	except (OSError, ValueError, KeyError):
+		return None
+
+
+def save_report_state(state_dir, state):
+	# Write into a temporary dir and swap it in, like save_frame_cache
+	tmp_dir = state_dir + ".tmp"
+	if os.path.isdir(tmp_dir):
+		shutil.rmtree(tmp_dir)
+	os.makedirs(tmp_dir)
+
+	reports = state["reports"]
+	rollups = {app_name: report["rollups"] for app_name, report in reports.items()}
+	np.savez(os.path.join(tmp_dir, "rollups.npz"), **flatten_arrays(rollups))
+	with open(os.path.join(tmp_dir, "state.json"), "w", encoding="utf-8") as f:
+		# Dicts keyed by frame values are stored as pairs to keep the value types
+		json.dump({
+			"version": REPORT_STATE_VERSION,
+			"config": state["config"],
+			"files": state["files"],
+			"rejected": state["rejected"],
+			"reports": {app_name: {
+				"users": report["users"],
+				"feedback": list(report["feedback"].items()),
+				"popularity": {field: [(day, dict(counter, counts=list(counter["counts"].items())))
+									   for day, counter in counters_per_day.items()]
+							   for field, counters_per_day in report["popularity"].items()},
+			} for app_name, report in reports.items()},
+		}, f)
+
+	if os.path.isdir(state_dir):
+		shutil.rmtree(state_dir)
+	os.replace(tmp_dir, state_dir)
+
+
+def is_report_state_current(state, config, stats):
+	# Check that the config is the same and folded files are unchanged
+	return state is not None and state["config"] == config and all(
+		list(stats.get(filename, ())) == stat for filename, stat in state["files"].items())
+
+
+def fold_telemetry_files(state, telemetry_source, stats, filenames):
+	# Fold new files into the state, returns False when it has to be rebuilt
+	rejected_counts = {}
+	app_aggregates = new_app_aggregates()
+
+	# Installation codes continue from the state
+	for app_name, aggregates in app_aggregates.items():
+		users = state["reports"][app_name]["users"]
+		aggregates["categories"]["installationId"] = {user: code for code, user in enumerate(users)}
+	aggregate_telemetry(app_aggregates, telemetry_source, filenames, rejected_counts, reset_event_store=False)
+	if not fold_report_state(state, app_aggregates):
+		print("Usage reports older than the report state arrived, rebuilding it")
+		return False
+
+	for filename in filenames:
+		state["files"][filename] = list(stats[filename])
+	for category, count in rejected_counts.items():
+		state["rejected"][category] += count
+	return True
+
+
+def rebuild_report_state(telemetry_source, config, stats, clear_report=True):
+	# Build the state and the report dir from all files
+	if clear_report:
+		clear_report_dir()
+	rejected_counts = {}
+	app_aggregates = aggregate_telemetry(telemetry_source=telemetry_source, rejected_counts=rejected_counts)
+	state = new_report_state(config)
+	state["reports"] = build_report_states(app_aggregates)
+	state["files"] = {filename: list(stat) for filename, stat in stats.items()}
+	state["rejected"] = rejected_counts
+	return state
+
+
+def update_report_state(telemetry_source=None, state=None, rebuild=False, clear_report=True):
+	# Fold files added since the last run into the report state, save and return it
+	# state is the current state when it is kept in memory, otherwise it is loaded
+	# rebuild builds it from all files, clear_report clears the report dir when it is rebuilt
+	telemetry_source = get_telemetry_source() if telemetry_source is None else telemetry_source
+	state_dir = get_report_state_dir(telemetry_source)
+	config = json.loads(json.dumps(get_report_config(telemetry_source)))
+	stats = stat_telemetry_files(telemetry_source)
+	state = load_report_state(state_dir) if state is None else state
+
+	if not rebuild and is_report_state_current(state, config, stats):
+		new_files = [filename for filename in stats if filename not in state["files"]]
+		if not new_files:
+			return state
+		if fold_telemetry_files(state, telemetry_source, stats, new_files):
+			save_report_state(state_dir, state)
+			return state
+
+	state = rebuild_report_state(telemetry_source, config, stats, clear_report)
+	save_report_state(state_dir, state)
+	return state
+
+
+def watch_telemetry(telemetry_source=None, interval=None, debounce=None):
+	# Keep the report live: poll the stat index of the source, fold in new files once
+	# it stopped changing for debounce seconds, and regenerate the report, rendering only
+	# the charts whose data changed
+	telemetry_source = get_telemetry_source() if telemetry_source is None else telemetry_source
+	interval = WATCH_INTERVAL if interval is None else interval
+	debounce = WATCH_DEBOUNCE if debounce is None else debounce
+
+	with measure_stage("ingest"):
+		state = update_report_state(telemetry_source)
+	display_report_state(state)
+	save_run_metrics()
+	print(f"Watching {telemetry_source}, {len(state['files'])} files in the report")
+
+	last_stats = None
+	changed_at = time.monotonic()
+	try:
+		while True:
+			time.sleep(interval)
+
+			# Files being written or an archive being appended to count as changes
+			try:
+				stats = stat_telemetry_files(telemetry_source)
+			except (OSError, zipfile.BadZipFile):
+				changed_at = time.monotonic()
+				continue
+			if stats != last_stats:
+				last_stats = stats
+				changed_at = time.monotonic()
+			if time.monotonic() - changed_at < debounce:
+				continue
+			if len(stats) == len(state["files"]) and all(
+					list(stats.get(filename, ())) == stat for filename, stat in state["files"].items()):
+				continue
 
-	return graph_data
+			# Batch everything that arrived since the last update
+			files_count = len(state["files"])
+			with measure_stage("ingest"):
+				state = update_report_state(telemetry_source, state)
+			display_report_state(state)
+			save_run_metrics()
+			print(f"Report updated, {len(state['files']) - files_count} new files")
+	except KeyboardInterrupt:
+		pass
+
+
+# ---- Sharded reports ---- #
+
+# Shards are disjoint parts of the telemetry files, like per node or per month directories.
+# Every shard keeps its own report state as a partial report, workers build or update them
+# and a reducer merges them into the report. Partials built on other nodes are merged by
+# their report state dirs. Usage time continues across shards as long as the reports of an
+# installation do not overlap in time between shards.
+
+# Settings a shard worker builds its report state with. main() resolves them from the arguments,
+# so they are passed to the workers explicitly: spawn and forkserver workers import the module
+# again and would see its defaults only
+SHARD_CONFIG_NAMES = [
+	"UTC_OFFSET", "START_TIME", "END_TIME", "REPORT_DIR", "CACHE_DIR", "REPORTS", "INCREMENTAL_REPORT",
+	"EVENT_STORE", "DISTINCT_COUNTING", "HLL_PRECISION", "POPULARITY_CAPACITY", "INGEST_WORKERS",
+	"INGEST_CHUNK_SIZE", "USE_FRAME_CACHE", "PROFILE_STAGES", "TRACE_MEMORY",
+]
+
+
+def get_shard_config(shard_workers):
+	# The ingest workers are split between the shard workers, so they never start
+	# shard_workers * INGEST_WORKERS processes
+	config = {name: globals()[name] for name in SHARD_CONFIG_NAMES}
+	config["INGEST_WORKERS"] = max(1, INGEST_WORKERS // shard_workers)
+	return config
+
+
+def apply_shard_config(config):
+	# Executor initializer of shard workers
+	globals().update(config)
+
+
+def update_partial_report(telemetry_source):
+	# Build or update the report state of a shard in a worker, returns its dir
+	# The report dir is cleared by the reducer and not by every worker
+	update_report_state(telemetry_source, rebuild=not INCREMENTAL_REPORT, clear_report=False)
+	return get_report_state_dir(telemetry_source)
+
+
+def update_partial_reports(shards, workers=None):
+	# Update report states of all shards, one worker process per shard
+	workers = SHARD_WORKERS if workers is None else workers
+	if workers <= 1 or len(shards) <= 1:
+		return [update_partial_report(shard) for shard in shards]
+	workers = min(workers, len(shards))
+	with ProcessPoolExecutor(max_workers=workers, initializer=apply_shard_config,
+							 initargs=(get_shard_config(workers),)) as executor:
+		return list(executor.map(update_partial_report, shards))
+
+
+def reduce_partial_reports(state_dirs):
+	# Merge report states of shards into the report state of all telemetry files
+	states = []
+	for state_dir in state_dirs:
+		state = load_report_state(state_dir)
+		if state is None:
+			raise ValueError(f"No report state in {state_dir}")
+		states.append(state)
+	config = json.loads(json.dumps(get_report_config(".")))
+	return merge_report_states(states, config)
+
+
+def report_shards(shards, partial_reports=(), partial_only=False):
+	# Update partial reports of shards, then merge them with partial_reports into the report
+	if not INCREMENTAL_REPORT and not partial_only:
+		clear_report_dir()
+	with measure_stage("ingest"):
+		state_dirs = update_partial_reports(shards)
+	if partial_only:
+		print(f"Partial reports saved into: {', '.join(state_dirs)}")
+	else:
+		with measure_stage("reduce"):
+			state = reduce_partial_reports(state_dirs + list(partial_reports))
+		display_report_state(state)
+	save_run_metrics()
 
 
-def create_graph(graph_data, graph_name, custom_x_labels=None, x_labels_shift = 0):
+def create_graph(graph_data, graph_name, custom_x_labels=None, x_labels_shift = 0, report_dir=None):
 
 	# Get X labels
 	x_labels = []
@@ -170,155 +1980,316 @@ def create_graph(graph_data, graph_name, custom_x_labels=None, x_labels_shift =
 		x_labels[i] = str(x_labels[i]).replace('\n', ' ')
 		i += 1
 
-	# Plot the graph
-	plt.figure(figsize=(12, 5))
-	plt.plot(x_labels, graph_data, marker='o', linestyle='-', color='teal')
-	plt.title(graph_name)
-	plt.xlabel("Time (UTC)")
-	plt.ylabel("Number of Statements")
-	plt.xticks(rotation=45)
-	plt.grid(True)
-	plt.tight_layout()
-	os.makedirs(REPORT_DIR, exist_ok=True)
-	filename = os.path.join(REPORT_DIR, f"{graph_name}.png")
-	plt.savefig(filename, dpi=150)
-	plt.close()
-
-
-def new_statistics_file():
+	# Downsample long series and cap tick labels, so render time does not grow with the window
+	points = downsample_graph(graph_data, GRAPH_MAX_POINTS, GRAPH_DOWNSAMPLING)
+	ticks = get_graph_ticks(len(x_labels), GRAPH_MAX_TICKS)
+
+	# Queue the graph, graphs are rendered together by render_graphs
+	graph_data = list(graph_data)
+	graph_queue.append({
+		"x": points.tolist(),
+		"data": [graph_data[point] for point in points.tolist()],
+		"ticks": ticks.tolist(),
+		"labels": [x_labels[tick] for tick in ticks.tolist()],
+		"title": graph_name,
+		"x_title": get_time_axis_label(),
+		"filename": os.path.join(REPORT_DIR if report_dir is None else report_dir, f"{graph_name}.png"),
+	})
+
+
+def downsample_lttb(values, target):
+	# Largest-Triangle-Three-Buckets: get indexes of target points keeping the shape and peaks
+	points_count = len(values)
+	if target >= points_count or target < 3:
+		return np.arange(points_count)
+	y = np.asarray(values, dtype=float)
+	x = np.arange(points_count, dtype=float)
+
+	# First and last points are kept, the rest is split into target - 2 buckets
+	edges = np.linspace(1, points_count - 1, target - 1).astype(np.int64)
+	kept = [0]
+	previous = 0
+	for bucket in range(target - 2):
+		start, end = edges[bucket], edges[bucket + 1]
+
+		# Average point of the next bucket, or the last point
+		if bucket + 2 < len(edges):
+			next_x = x[end:edges[bucket + 2]].mean()
+			next_y = y[end:edges[bucket + 2]].mean()
+		else:
+			next_x = x[-1]
+			next_y = y[-1]
+
+		# Keep the point forming the largest triangle with the previous kept point and the next average
+		areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous]) -
+					   (x[previous] - x[start:end]) * (next_y - y[previous]))
+		previous = int(start + np.argmax(areas))
+		kept.append(previous)
+
+	kept.append(points_count - 1)
+	return np.asarray(kept, dtype=np.int64)
+
+
+def downsample_min_max(values, target):
+	# Min/max envelope: get indexes of the lowest and highest point of target / 2 buckets
+	points_count = len(values)
+	if target >= points_count or target < 2:
+		return np.arange(points_count)
+	y = np.asarray(values, dtype=float)
+	edges = np.linspace(0, points_count, target // 2 + 1).astype(np.int64)
+	kept = []
+	for start, end in zip(edges[:-1].tolist(), edges[1:].tolist()):
+		segment = y[start:end]
+		kept.extend(sorted({start + int(np.argmin(segment)), start + int(np.argmax(segment))}))
+	return np.asarray(kept, dtype=np.int64)
+
+
+def downsample_graph(graph_data, max_points, method):
+	# Get indexes of points to plot, all of them when max_points is None
+	if max_points is None or len(graph_data) <= max_points:
+		return np.arange(len(graph_data))
+	if method == "lttb":
+		return downsample_lttb(graph_data, max_points)
+	if method == "min_max":
+		return downsample_min_max(graph_data, max_points)
+	raise ValueError(f"Unknown downsampling method: {method}")
+
+
+def get_graph_ticks(labels_count, max_ticks):
+	# Get evenly spread indexes of X labels to show
+	if max_ticks is None or labels_count <= max_ticks:
+		return np.arange(labels_count)
+	return np.unique(np.linspace(0, labels_count - 1, max_ticks).round().astype(np.int64))
+
+
+def render_graph(graph):
+	# Plot the graph headless with the Agg canvas, matplotlib is loaded only when a graph is rendered
+	from matplotlib.backends.backend_agg import FigureCanvasAgg
+	from matplotlib.figure import Figure
+
+	figure = Figure(figsize=(12, 5))
+	FigureCanvasAgg(figure)
+	axes = figure.add_subplot()
+	axes.plot(graph["x"], graph["data"], marker='o', linestyle='-', color='teal')
+	axes.set_xticks(graph["ticks"], graph["labels"])
+	axes.set_title(graph["title"])
+	axes.set_xlabel(graph["x_title"])
+	axes.set_ylabel("Number of Statements")
+	axes.tick_params(axis="x", labelrotation=45)
+	axes.grid(True)
+	figure.tight_layout()
+	figure.savefig(graph["filename"], dpi=150)
+
+
+def get_graph_key(graph):
+	return hashlib.sha256(repr(sorted(graph.items())).encode("utf-8")).hexdigest()
+
+
+def render_graphs(workers=None):
+	# Render all queued graphs in a process pool, the report is done when the slowest graph is
+	# Graphs already rendered by this process with the same data are skipped
+	workers = RENDER_WORKERS if workers is None else workers
+
+	graphs = []
+	for graph in graph_queue:
+		key = get_graph_key(graph)
+		if rendered_graphs.get(graph["filename"]) == key and os.path.isfile(graph["filename"]):
+			continue
+		rendered_graphs[graph["filename"]] = key
+		graphs.append(graph)
+	count_items("charts_rendered", len(graphs))
+	count_items("charts_unchanged", len(graph_queue) - len(graphs))
+	graph_queue.clear()
+
+	# Start with the largest graphs so they do not end up last
+	graphs.sort(key=lambda graph: len(graph["data"]) + len(graph["labels"]), reverse=True)
+	for graph in graphs:
+		os.makedirs(os.path.dirname(graph["filename"]), exist_ok=True)
+
+	if workers <= 1 or len(graphs) <= 1:
+		for graph in graphs:
+			render_graph(graph)
+		return
+	with ProcessPoolExecutor(max_workers=min(workers, len(graphs))) as executor:
+		list(executor.map(render_graph, graphs))
+
+
+# ---- Run metrics ---- #
+
+@contextmanager
+def measure_stage(name):
+	# Record wall time, CPU time, peak traced memory and item counts of a stage into run_metrics,
+	# with PROFILE_STAGES a cProfile dump of the stage is written into REPORT_DIR/profiles
+	if TRACE_MEMORY and not tracemalloc.is_tracing():
+		tracemalloc.start()
+	if tracemalloc.is_tracing():
+		tracemalloc.reset_peak()
+	profile = cProfile.Profile() if PROFILE_STAGES else None
+
+	stage = {"name": name, "counts": {}}
+	active_stages.append(stage)
+	wall_started = time.perf_counter()
+	cpu_started = time.process_time()
+	if profile is not None:
+		profile.enable()
+	try:
+		yield stage["counts"]
+	finally:
+		if profile is not None:
+			profile.disable()
+		stage["wall_seconds"] = time.perf_counter() - wall_started
+		stage["cpu_seconds"] = time.process_time() - cpu_started
+		stage["peak_memory_mb"] = tracemalloc.get_traced_memory()[1] / 1e6 if tracemalloc.is_tracing() else None
+		active_stages.remove(stage)
+		run_metrics.append(stage)
+
+		if profile is not None:
+			profiles_dir = os.path.join(REPORT_DIR, "profiles")
+			os.makedirs(profiles_dir, exist_ok=True)
+			profile.dump_stats(os.path.join(profiles_dir, f"{name}.prof"))
+
+
+def count_items(name, count):
+	# Add to an item count of the innermost running stage, if any
+	if active_stages:
+		counts = active_stages[-1]["counts"]
+		counts[name] = counts.get(name, 0) + count
+
+
+def save_run_metrics():
+	# Write metrics of the stages run since the last save into REPORT_DIR/run_metrics.json
 	os.makedirs(REPORT_DIR, exist_ok=True)
-	path = os.path.join(REPORT_DIR, STATS_FILE)
+	metrics = {
+		"time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+		"wall_seconds": sum(stage["wall_seconds"] for stage in run_metrics),
+		"cpu_seconds": sum(stage["cpu_seconds"] for stage in run_metrics),
+		"stages": list(run_metrics),
+	}
+	with open(os.path.join(REPORT_DIR, "run_metrics.json"), "w", encoding="utf-8") as f:
+		json.dump(metrics, f, indent=1)
+	run_metrics.clear()
+
+
+def get_app_report_dirs():
+	# Get { appName: report dir }, apps without their own report_dir report into REPORT_DIR
+	# for the first app and into REPORT_DIR/appName for the others
+	report_dirs = {}
+	for index, (app_name, definition) in enumerate(REPORTS.items()):
+		report_dir = definition.get("report_dir") or (REPORT_DIR if index == 0 else os.path.join(REPORT_DIR, app_name))
+		for other_app_name, other_report_dir in report_dirs.items():
+			if os.path.abspath(report_dir) == os.path.abspath(other_report_dir):
+				raise ValueError(f"Apps {other_app_name} and {app_name} report into the same dir {report_dir}")
+		report_dirs[app_name] = report_dir
+	return report_dirs
+
+
+def get_app_report_dir(app_name):
+	return get_app_report_dirs()[app_name]
+
+
+def clear_report_dir():
+	for report_dir in {REPORT_DIR, *get_app_report_dirs().values()}:
+		if os.path.isdir(report_dir):
+			shutil.rmtree(report_dir)
+
+
+def new_statistics_file(report_dir=None):
+	report_dir = REPORT_DIR if report_dir is None else report_dir
+	os.makedirs(report_dir, exist_ok=True)
+	path = os.path.join(report_dir, STATS_FILE)
 	# Open in write mode to create or clear existing file, then immediately close
 	with open(path, 'w', encoding='utf-8') as f:
 		pass  # truncates file
 
 
-def append_statistics_line(line: str):
-	path = os.path.join(REPORT_DIR, STATS_FILE)
+def append_statistics_line(line: str, report_dir=None):
+	report_dir = REPORT_DIR if report_dir is None else report_dir
+	path = os.path.join(report_dir, STATS_FILE)
 	# Ensure the file is initialized
-	os.makedirs(REPORT_DIR, exist_ok=True)
+	os.makedirs(report_dir, exist_ok=True)
 	# Append the line
 	with open(path, 'a', encoding='utf-8') as f:
 		f.write(line.rstrip("\n") + "\n")
 
 
-def count_popularity_of_statement_variants(data, dictionary, statement):
+def count_popularity_of_statement_variants(data, counter, statement):
 	if statement in data:
 		variant = data.get(statement)
-		if variant not in dictionary.keys():
-			dictionary[variant] = 0
-		dictionary[variant] += 1
-	return dictionary
+		counts = counter["counts"]
+		if variant not in counts.keys():
+			counts[variant] = counter["floor"]
+		counts[variant] += 1
+
+		# Prune once in capacity new variants
+		if counter["capacity"] is not None and len(counts) >= 2 * counter["capacity"]:
+			prune_popularity_counter(counter)
+	return counter
 
 
 def sort_and_unpack_popularity_dictionary(dictionary):
 	dictionary_sorted = sorted(dictionary.items(), key=lambda item: item[1], reverse=True)
+	if not dictionary_sorted:
+		return (), ()
 	keys, values = zip(*dictionary_sorted)
 	return keys, values
 
 
 def parse_date(s: str) -> int:
-	return int(datetime.strptime(s, "%Y/%m/%d").timestamp())
+	# Midnight of the report time (UTC_OFFSET)
+	return int(datetime.strptime(s, "%Y/%m/%d").replace(tzinfo=timezone.utc).timestamp()) - UTC_OFFSET
 
 
 def display_data(data, non_txt_files, non_json_files, non_standard_files):
+	# Report from a list of frames
+	app_aggregates = aggregate_frames(normalize_frames([data]))
+	display_aggregates(app_aggregates, non_txt_files, non_json_files, non_standard_files)
 
-	# ---- Setup ---- #
 
-	# Cleanup
-	new_statistics_file()
+def display_aggregates(app_aggregates, non_txt_files, non_json_files, non_standard_files):
+	# Report from streamed aggregates of every app
+	with measure_stage("rollups"):
+		reports = build_report_states(app_aggregates)
+	rejected_counts = {"non_txt": non_txt_files, "non_json": non_json_files, "non_standard": non_standard_files}
+	display_reports(reports, rejected_counts)
 
-	# Get structure
-	user_actions = get_users_action_structure(data)
 
-	# Add statements
+def display_report_state(state):
+	display_reports(state["reports"], state["rejected"])
 
-	# Statements
-	for statement in STATEMENTS:
-		user_actions = add_statement_per_user(data, user_actions,
-											  "statementType", statement)
 
-	# Checkpoints
-	for checkpoint in CHECKPOINTS:
-		user_actions = add_statement_per_user(data, user_actions,
-											  "checkpointName", checkpoint)
+# ---- Report sections ---- #
 
-	# Functions
-	for function in FUNCTIONS:
-		user_actions = add_statement_per_user(data, user_actions,
-											  "usedFunctionName", function)
-	
-	# Device types
-	for device_type in DEVICE_TYPES:
-		user_actions = add_statement_per_user(data, user_actions,
-											  "deviceType", device_type)
-
-	# ---- Text Reviews ---- #
-
-	text_feedback_dir = os.path.join(REPORT_DIR, "user_feedback_text")
+def report_text_reviews(report):
+	# Text Reviews
+	text_feedback_dir = os.path.join(report["report_dir"], "user_feedback_text")
 	os.makedirs(text_feedback_dir, exist_ok=True)
 
-	for data_frame in data:
-		if (data_frame.get("statementType") == "userFeedbackFormWith5StarRatingAndText" and
-				data_frame.get("appName") == "OpenAudioTools"):
-
-			try:
-				unix_time = int(data_frame.get("unixTime"))
-			except (TypeError, ValueError):
-				continue
-
-			# Respect global time window
-			if not (START_TIME < unix_time < END_TIME):
-				continue
-
-			# Build date-based filename
-			date_str = datetime.fromtimestamp(unix_time).strftime("%Y_%m_%d")
-			day_file = os.path.join(text_feedback_dir, f"{date_str}.txt")
-
-			# Sanitize text: force single-line review
-			text = str(data_frame.get("text", "")).replace("\n", " ").replace("\r", " ").strip()
-
-			line = f"{unix_time} | {data_frame.get('appVersion')} | {data_frame.get('installationId')} | {text}"
-
-			with open(day_file, "a", encoding="utf-8") as f:
-				f.write(line + "\n")
-
-	# ---- Star Reviews ---- #
-
-	ratings_per_day = {}
-
-	for data_frame in data:
-		if (data_frame.get("statementType") == "userFeedbackFormWith5StarRatingAndText" and
-				data_frame.get("appName") == "OpenAudioTools"):
-
-			try:
-				unix_time = int(data_frame.get("unixTime"))
-			except (TypeError, ValueError):
-				continue
-
-			if not (START_TIME < unix_time < END_TIME):
-				continue
-
-			day_key = datetime.fromtimestamp(unix_time).strftime("%Y-%m-%d")
+	# Write one date-based file per day of the report window, files of days outside it are removed
+	for filename in os.listdir(text_feedback_dir):
+		if filename.endswith(".txt"):
+			os.remove(os.path.join(text_feedback_dir, filename))
+	first_day = get_first_time_bucket(START_TIME, DAY_STEP)
+	last_day = get_first_time_bucket(END_TIME, DAY_STEP)
+	for day, lines in report["feedback"].items():
+		if not (first_day <= day < last_day):
+			continue
+		date_str = format_time_buckets([day], DAY_STEP, "%Y_%m_%d")[0]
+		day_file = os.path.join(text_feedback_dir, f"{date_str}.txt")
+		with open(day_file, "w", encoding="utf-8") as f:
+			f.writelines(lines)
 
-			if day_key not in ratings_per_day:
-				ratings_per_day[day_key] = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0}
 
-			# Parse rating
-			try:
-				rating = int(data_frame.get("5StarRating"))
-				if rating < 1 or rating > 5:
-					rating = 0
-			except (TypeError, ValueError):
-				rating = 0
+def report_star_reviews(report):
+	# Star Reviews
+	rollups = report["rollups"]
 
-			ratings_per_day[day_key][rating] += 1
+	days, ratings_per_day = sum_rollups_per_day(
+		rollups["ratings"]["hours"], rollups["ratings"]["counts"], START_TIME, END_TIME)
 
 	# Write aggregated report
-	rating_file = os.path.join(REPORT_DIR, "user_feedback_rating.txt")
+	rating_file = os.path.join(report["report_dir"], "user_feedback_rating.txt")
 	with open(rating_file, "w", encoding="utf-8") as f:
-		for day in sorted(ratings_per_day.keys()):
-			counts = ratings_per_day[day]
+		for day, counts in zip(format_time_buckets(days, DAY_STEP, "%Y-%m-%d"), ratings_per_day.tolist()):
 
 			total_valid = sum(star * counts[star] for star in range(1, 6))
 			total_votes = sum(counts[star] for star in range(1, 6))
@@ -337,344 +2308,458 @@ def display_data(data, non_txt_files, non_json_files, non_standard_files):
 
 			f.write(line + "\n")
 
-	# ---- Activity ---- #
-
-	# Activity graph (1H, 1D, 1W, 1M)
-	for time_step in [[3600, "hour"], [86400, "day"], [604800, "week"], [2419200, "month"]]:
-		graph_name = f"Active users per {time_step[1]}"
-		statement = "sixHoursActivityReport"
-		# Calculate graph data
-		graph_data = calculate_graph_data_by_statements_count_per_time(
-			user_actions, statement, START_TIME, END_TIME, time_step[0], True)
-		create_graph(graph_data, graph_name)
-
-	# New installation launches
-	graph_name = "New installation launches per day"
-	statement = "newInstallationLaunchReport"
-	time_step = 86400  # 1 day
-	graph_data = calculate_graph_data_by_statements_count_per_time(
-		user_actions, statement, START_TIME, END_TIME, time_step, True)
-	create_graph(graph_data, graph_name)
-
-	# ---- Usage Time Per Day Graph (including zero days) ---- #
-
-	# Collect usage reports per installation
-	usage_reports_per_user = {}
-
-	for data_frame in data:
-		if (data_frame.get("statementType") == "sixHoursUsageTimeReport" and
-		        data_frame.get("appName") == "OpenAudioTools"):
-
-		    try:
-		        unix_time = int(data_frame.get("unixTime"))
-		        usage_time = int(data_frame.get("usageTime"))
-		        iid = data_frame.get("installationId")
-		    except (TypeError, ValueError):
-		        continue
-
-		    if not (START_TIME < unix_time < END_TIME):
-		        continue
-
-		    if iid not in usage_reports_per_user:
-		        usage_reports_per_user[iid] = []
-
-		    usage_reports_per_user[iid].append((unix_time, usage_time))
-
-	# Compute per-day deltas
-	usage_time_per_day = {}
-
-	for iid, reports in usage_reports_per_user.items():
-		# Sort reports by time
-		reports.sort(key=lambda x: x[0])
-
-		previous_usage = None
-
-		for unix_time, usage_time in reports:
-		    if previous_usage is None:
-		        # First record for this user inside window
-		        # We cannot know how much was used before START_TIME,
-		        # so we treat the first record as baseline and skip delta
-		        previous_usage = usage_time
-		        continue
 
-		    delta = usage_time - previous_usage
-		    previous_usage = usage_time
+def report_activity(report):
+	# Activity
+	rollups = report["rollups"]
 
-		    # Ignore corrupted / reset cases
-		    if delta <= 0:
-		        continue
+	# Statements per time step graphs of the report definition
+	for graph in report["definition"]["graphs"]:
+		graph_data = calculate_graph_data_by_statements_count_per_time(
+			rollups, graph["statement"], START_TIME, END_TIME, graph["time_step"], graph["per_installation"])
+		create_graph(graph_data, graph["title"], report_dir=report["report_dir"])
 
-		    day_key = datetime.fromtimestamp(unix_time).strftime("%Y-%m-%d")
 
-		    if day_key not in usage_time_per_day:
-		        usage_time_per_day[day_key] = 0
+def report_usage_time(report):
+	# Usage Time Per Day Graph (including zero days)
+	rollups = report["rollups"]
 
-		    usage_time_per_day[day_key] += delta
+	days, usage_time_per_day = sum_rollups_per_day(
+		rollups["usage"]["hours"], rollups["usage"]["seconds"], START_TIME, END_TIME)
 
 	# Generate ALL days in range
-	current_day = datetime.fromtimestamp(START_TIME)
-	end_day = datetime.fromtimestamp(END_TIME)
-
-	graph_data = []
-	x_labels = []
-
-	while current_day <= end_day:
-		day_key = current_day.strftime("%Y-%m-%d")
+	first_day = get_time_buckets(START_TIME, DAY_STEP)
+	all_days = np.arange(first_day, get_time_buckets(END_TIME, DAY_STEP) + 1)
 
-		value = usage_time_per_day.get(day_key, 0)
-		graph_data.append(value)
-		x_labels.append(day_key)
-
-		current_day += timedelta(days=1)
+	graph_data = np.zeros(len(all_days), dtype=np.int64)
+	graph_data[days - first_day] = usage_time_per_day
+	x_labels = format_time_buckets(all_days, DAY_STEP, "%Y-%m-%d")
 
 	create_graph(
 		graph_data,
 		"Usage time per day (seconds)",
-		custom_x_labels=x_labels
+		custom_x_labels=x_labels,
+		report_dir=report["report_dir"]
 	)
 
-	# ---- Installations, Checkpoints, Functions ---- #
+
+def report_statistics(report):
+	# Installations, Checkpoints, Functions
+	rollups = report["rollups"]
+	definition = report["definition"]
+	rejected = report["rejected"]
+	report_dir = report["report_dir"]
 
 	# Statistics
-	append_statistics_line(f"Statistics:")
+	new_statistics_file(report_dir)
+	append_statistics_line(f"Statistics:", report_dir)
 
 	# Not included files
-	append_statistics_line(f"Non-TXT files: {non_txt_files}")
-	append_statistics_line(f"Non-JSON files: {non_json_files}")
-	append_statistics_line(f"Non-standard JSON files: {non_standard_files}")
+	append_statistics_line(f"Non-TXT files: {rejected['non_txt']}", report_dir)
+	append_statistics_line(f"Non-JSON files: {rejected['non_json']}", report_dir)
+	append_statistics_line(f"Non-standard JSON files: {rejected['non_standard']}", report_dir)
 
 	# Installations
-	append_statistics_line(f"")
-	append_statistics_line(f"Installations:")
+	append_statistics_line(f"", report_dir)
+	append_statistics_line(f"Installations:", report_dir)
 
 	# New installation launch report
-	count = count_users_with_existent_statement(user_actions, "newInstallationLaunchReport")
-	append_statistics_line(f"New installations launch report: {count}")
-	
-	# Android install launches
-	count = count_users_with_existent_statement(user_actions, "Android")
-	append_statistics_line(f"Android install launches: {count}")
-	
-	# Desktop install launches
-	count = count_users_with_existent_statement(user_actions, "Desktop")
-	append_statistics_line(f"Desktop install launches: {count}")
-
-	# Checkpoints
-	append_statistics_line(f"")
-	append_statistics_line(f"Checkpoints:")
+	count = count_users_with_existent_statement(rollups, "newInstallationLaunchReport", START_TIME, END_TIME)
+	append_statistics_line(f"New installations launch report: {count}", report_dir)
 
-	# Second launch
-	count = count_users_with_existent_statement(user_actions, "secondLaunch")
-	append_statistics_line(f"Second launch: {count}")
+	# Install launches per device type
+	for device_type, label in definition["device_types"].items():
+		count = count_users_with_existent_statement(rollups, device_type, START_TIME, END_TIME)
+		append_statistics_line(f"{label}: {count}", report_dir)
 
-	# Recording saved first time
-	count = count_users_with_existent_statement(user_actions, "recordingSavedFirstTime")
-	append_statistics_line(f"Recording saved first time: {count}")
-
-	# Recording preview played first time
-	count = count_users_with_existent_statement(user_actions, "recordingPreviewPlayedFirstTime")
-	append_statistics_line(f"Recording preview played first time: {count}")
-
-	# Recording loaded first time
-	count = count_users_with_existent_statement(user_actions, "recordingLoadedFirstTime")
-	append_statistics_line(f"Recording loaded first time: {count}")
+	# Checkpoints
+	append_statistics_line(f"", report_dir)
+	append_statistics_line(f"Checkpoints:", report_dir)
+	for checkpoint, label in definition["checkpoints"].items():
+		count = count_users_with_existent_statement(rollups, checkpoint, START_TIME, END_TIME)
+		append_statistics_line(f"{label}: {count}", report_dir)
 
 	# Functions
-	append_statistics_line(f"")
-	append_statistics_line(f"Functions:")
-
-	# Recording saved
-	count = count_statements(user_actions, "recordingSaved")
-	append_statistics_line(f"Recording saved: {count}")
+	append_statistics_line(f"", report_dir)
+	append_statistics_line(f"Functions:", report_dir)
+	for function, label in definition["functions"].items():
+		count = count_statements(rollups, function, START_TIME, END_TIME)
+		append_statistics_line(f"{label}: {count}", report_dir)
 
-	# Recording preview played
-	count = count_statements(user_actions, "recordingPreviewPlayed")
-	append_statistics_line(f"Recording preview played: {count}")
+	# Activity
+	append_statistics_line(f"", report_dir)
+	append_statistics_line(f"Activity:", report_dir)
 
-	# Recording loaded
-	count = count_statements(user_actions, "recordingLoaded")
-	append_statistics_line(f"Recording loaded: {count}")
-	
-	# Functions
-	append_statistics_line(f"")
-	append_statistics_line(f"Activity:")
-	
 	# Six hours activity report
-	count = count_statements(user_actions, "sixHoursActivityReport")
-	append_statistics_line(f"Six hours activity reports: {count}")
+	count = count_statements(rollups, "sixHoursActivityReport", START_TIME, END_TIME)
+	append_statistics_line(f"Six hours activity reports: {count}", report_dir)
 
 	# Total usage time
-	count = count_statements(user_actions, "sixHoursUsageTimeReport")
-	append_statistics_line(f"Six hours usage time reports: {count}")
-	usage_reports_per_user = {}
-	
-	for data_frame in data:
-		if (data_frame.get("statementType") == "sixHoursUsageTimeReport" and
-		        data_frame.get("appName") == "OpenAudioTools"):
-
-		    try:
-		        unix_time = int(data_frame.get("unixTime"))
-		        usage_time = int(data_frame.get("usageTime"))
-		        iid = data_frame.get("installationId")
-		    except (TypeError, ValueError):
-		        continue
-
-		    if not (START_TIME < unix_time < END_TIME):
-		        continue
+	count = count_statements(rollups, "sixHoursUsageTimeReport", START_TIME, END_TIME)
+	append_statistics_line(f"Six hours usage time reports: {count}", report_dir)
+	usage = rollups["usage"]
+	total_usage_time = int(usage["seconds"][get_rollup_rows(usage["hours"], START_TIME, END_TIME)].sum())
+	append_statistics_line(f"Total usage time: {total_usage_time}", report_dir)
 
-		    if iid not in usage_reports_per_user:
-		        usage_reports_per_user[iid] = []
 
-		    usage_reports_per_user[iid].append((unix_time, usage_time))
+def report_lifetime(report):
+	# User lifetime
+	rollups = report["rollups"]
 
-	total_usage_time = 0
-
-	for iid, reports in usage_reports_per_user.items():
-		reports.sort(key=lambda x: x[0])
-
-		previous_usage = None
-
-		for _, usage_time in reports:
-		    if previous_usage is None:
-		        previous_usage = usage_time
-		        continue
-
-		    delta = usage_time - previous_usage
-		    previous_usage = usage_time
-
-		    if delta > 0:
-		        total_usage_time += delta
-
-	append_statistics_line(f"Total usage time: {total_usage_time}")
-
-	# ---- User lifetime ---- #
-
-	lifetime_duration_days = [0, 0]
 	time_step_day = 86400  # 1 day
 
 	# Calculate, how many days user lifetime lasts X: days Y: amount of users
-	for user in user_actions:
-		if "sixHoursActivityReport" not in user_actions[user]:
-			continue
-		dates = user_actions[user]["sixHoursActivityReport"]
-		if len(dates) <= 1:
-			lifetime_duration_days[0] += 1
-			continue
-		lowest_time = END_TIME
-		highest_time = START_TIME
-		for date in dates:
-			date_int = int(date)
-			if date_int < lowest_time:
-				lowest_time = date_int
-			if date_int > highest_time:
-				highest_time = date_int
-		if lowest_time >= highest_time:
-			continue
-		days = int(floor((int(highest_time) - int(lowest_time)) / time_step_day))
-		while len(lifetime_duration_days) <= days:
-			lifetime_duration_days.append(0)
-		lifetime_duration_days[days] += 1
+	lifetime = rollups["lifetime"]
+	is_active = lifetime["counts"] > 0
+	counts = lifetime["counts"][is_active]
+	lowest_time = np.minimum(lifetime["first"][is_active], END_TIME)
+	highest_time = np.maximum(lifetime["last"][is_active], START_TIME)
+	has_lifetime = (counts > 1) & (lowest_time < highest_time)
+	days = (highest_time[has_lifetime] - lowest_time[has_lifetime]) // time_step_day
+	lifetime_duration_days = np.bincount(days, minlength=2)
+	lifetime_duration_days[0] += np.count_nonzero(counts <= 1)
+	lifetime_duration_days = lifetime_duration_days.tolist()
 
 	# Create graph (all)
 	create_graph(lifetime_duration_days,
-				 "User lifetime duration days")
+				 "User lifetime duration days", report_dir=report["report_dir"])
 
 	# Create graph (2 days and more)
 	lifetime_duration_days_2_and_more = lifetime_duration_days
 	lifetime_duration_days_2_and_more.pop(0)
 	create_graph(lifetime_duration_days_2_and_more,
-				 "User lifetime duration days (2 days and more)", x_labels_shift=1)
-
-	# ---- User Info Report ---- #
-
-	# Variables
-	platform_popularity = {}
-	language_popularity = {}
-	country_popularity = {}
-	timezone_popularity = {}
-
-	# Count
-	for frame in data:
-		if (("statementType" not in frame) or ("deviceType" not in frame) or
-				(frame["statementType"] != "newInstallationLaunchReport")):
-			continue # Skip non newInstallationLaunchReport types
-
-		# Check time
-		if not (START_TIME < int(frame["unixTime"]) < END_TIME):
-			continue
-
-		# Process platforms
-		platform_popularity = count_popularity_of_statement_variants(
-				frame, platform_popularity, "deviceType")
-
-		# Process by platform
-		device_type = frame.get("deviceType")
-		if device_type == "Desktop" or device_type == "Android":
-
-			# Language popularity
-			language_popularity = count_popularity_of_statement_variants(
-				frame, language_popularity, "language")
-
-			# Country popularity
-			country_popularity = count_popularity_of_statement_variants(
-				frame, country_popularity, "country")
-
-			# Time zone popularity
-			timezone_popularity = count_popularity_of_statement_variants(
-				frame, timezone_popularity, "timeZone")
-
-	# Make graphs
-
-	keys, values = sort_and_unpack_popularity_dictionary(platform_popularity)
-	create_graph(values, "Platform Popularity", keys)
-
-	keys, values = sort_and_unpack_popularity_dictionary(language_popularity)
-	create_graph(values, "Language Popularity", keys)
-
-	keys, values = sort_and_unpack_popularity_dictionary(language_popularity)
-	keys = keys[:23]; values = values[:23]
-	create_graph(values, "Language Popularity (24 most popular)", keys)
-
-	keys, values = sort_and_unpack_popularity_dictionary(country_popularity)
-	create_graph(values, "Country Popularity (By region settings)", keys)
-
-	keys, values = sort_and_unpack_popularity_dictionary(country_popularity)
-	keys = keys[:23]; values = values[:23]
-	create_graph(values, "Country Popularity (By region settings) (24 most popular)", keys)
-
-	keys, values = sort_and_unpack_popularity_dictionary(timezone_popularity)
-	create_graph(values, "Time Zone Popularity", keys)
-
-	keys, values = sort_and_unpack_popularity_dictionary(timezone_popularity)
-	keys = keys[:23]; values = values[:23]
-	create_graph(values, "Time Zone Popularity (24 most popular)", keys)
+				 "User lifetime duration days (2 days and more)", x_labels_shift=1, report_dir=report["report_dir"])
+
+
+def report_retention(report):
+	# Day N retention by install day and week
+	retention = build_retention(report["rollups"], START_TIME, END_TIME)
+	if retention is None:
+		print("Retention needs exact distinct counting, skipped")
+		return
+
+	for cohort_days, name in [(1, "day"), (7, "week")]:
+		cohorts, installations, matrix = get_retention_matrix(retention, cohort_days, RETENTION_DAYS)
+		path = os.path.join(report["report_dir"], f"retention_by_install_{name}.csv")
+		with open(path, "w", encoding="utf-8") as f:
+			f.write(",".join([f"install_{name}", "installations"] +
+							 [f"day_{day_n}" for day_n in range(RETENTION_DAYS + 1)]) + "\n")
+			labels = format_time_buckets(cohorts, DAY_STEP, "%Y-%m-%d")
+			for label, count, row in zip(labels, installations.tolist(), matrix.tolist()):
+				cells = ["" if value < 0 else str(value) for value in row]
+				f.write(",".join([label, str(count)] + cells) + "\n")
+
+	curve = get_retention_curve(retention, RETENTION_DAYS)
+	create_graph((curve * 100).round(2).tolist(), "Retention by days since first activity (percent)",
+				 report_dir=report["report_dir"])
+
+
+def report_funnel(report):
+	# Conversion through the checkpoints of the report definition, rewritten on every run
+	checkpoints = report["definition"]["checkpoints"]
+	funnel_file = os.path.join(report["report_dir"], FUNNEL_FILE)
+	counts = get_funnel(report["rollups"], checkpoints, START_TIME, END_TIME)
+	if counts is None:
+		print("Funnel needs exact distinct counting, skipped")
+		if os.path.exists(funnel_file):
+			os.remove(funnel_file)
+		return
+
+	os.makedirs(report["report_dir"], exist_ok=True)
+	with open(funnel_file, "w", encoding="utf-8") as f:
+		f.write("Funnel:\n")
+		f.write(f"New installations launch report: {counts[0]}\n")
+		for label, previous, count in zip(checkpoints.values(), counts, counts[1:]):
+			of_installations = count / counts[0] * 100 if counts[0] else 0
+			of_previous = count / previous * 100 if previous else 0
+			f.write(f"{label}: {count} ({of_installations:.1f}% of installations, {of_previous:.1f}% of previous step)\n")
+
+
+def report_popularity(report):
+	# User Info Report
+	capacities = get_popularity_capacities(report["definition"])
+	for chart in report["definition"]["popularity"]:
+		field = chart["field"]
+		counter = merge_popularity_per_day(report["popularity"][field], capacities[field], START_TIME, END_TIME)
+		keys, values = get_popular_variants(counter)
+		create_graph(values, chart["title"], keys, report_dir=report["report_dir"])
+
+		# Most popular variants only
+		if "top" in chart:
+			top = chart["top"]
+			create_graph(values[:top], chart["top_title"], keys[:top], report_dir=report["report_dir"])
+
+
+# Report sections by name, in the order display_reports runs them
+REPORT_SECTIONS = {
+	"text_reviews": report_text_reviews,
+	"star_reviews": report_star_reviews,
+	"activity": report_activity,
+	"usage_time": report_usage_time,
+	"statistics": report_statistics,
+	"funnel": report_funnel,
+	"lifetime": report_lifetime,
+	"retention": report_retention,
+	"popularity": report_popularity,
+}
+STATS_ONLY_SECTIONS = ["text_reviews", "star_reviews", "statistics", "funnel"]
+
+
+def display_reports(reports, rejected_counts, sections=None):
+	# Run the report sections, all or the given names, of every app report,
+	# then render the graphs they queued together so all apps share one process pool
+	sections = SECTIONS if sections is None else sections
+	for app_name, report in reports.items():
+		report = {
+			**report,
+			"definition": REPORTS[app_name],
+			"report_dir": get_app_report_dir(app_name),
+			"rejected": rejected_counts,
+		}
+		for name, section in REPORT_SECTIONS.items():
+			if sections is None or name in sections:
+				with measure_stage(f"{app_name}.{name}"):
+					section(report)
+
+	if graph_queue:
+		with measure_stage("render"):
+			render_graphs()
 
 
 # Config
 TELEMETRY_DIR = "collected_telemetry"
+TELEMETRY_ZIP = "collected_telemetry.zip"
+TELEMETRY_SOURCE = "zip"  # "zip" to read TELEMETRY_ZIP without unpacking, "dir" to read TELEMETRY_DIR
 REPORT_DIR = "telemetry_report_for_openaudiotools"
 STATS_FILE = "statistics.txt"
+FUNNEL_FILE = "funnel.txt"
+
+# Ingest
+opened_telemetry_zips = {}
+INGEST_WORKERS = os.cpu_count() or 1
+INGEST_CHUNK_SIZE = 2000
+
+# Cache of parsed frames, only new or changed files are parsed on reruns
+USE_FRAME_CACHE = True
+CACHE_DIR = "telemetry_cache"
+
+# Keep the report state between runs and fold in only new files
+INCREMENTAL_REPORT = True
+
+# Watch mode, keep the report up to date as new files land
+WATCH = False
+WATCH_INTERVAL = 5  # seconds between polls
+WATCH_DEBOUNCE = 10  # seconds without changes before new files are folded in
+
+# SQLite database to load frames into for ad-hoc queries, e.g. "telemetry_events.sqlite", None to skip
+EVENT_STORE = None
+
+# Sharded reports, telemetry dirs or zips to build partial reports of in worker processes and merge
+SHARDS = None  # e.g. ["shards/2025_07", "shards/2025_08"], None to report TELEMETRY_SOURCE
+SHARD_WORKERS = os.cpu_count() or 1  # Every worker parses its shard with INGEST_WORKERS // SHARD_WORKERS processes
+PARTIAL_REPORTS = []  # Report state dirs of shards built on other nodes, merged into the report
+PARTIAL_ONLY = False  # Only build the partial reports of SHARDS, e.g. on a worker node
+
+# Active installations, "exact" keeps every (hour, installation) pair, "hll" keeps a HyperLogLog
+# sketch per hour and statement, see Distinct counting sketches for the error bound
+DISTINCT_COUNTING = "exact"
+HLL_PRECISION = 12  # 4 to 18, 2 ** precision bytes per sketch, relative standard error 1.04 / sqrt(2 ** precision)
+
+# Rendering
+graph_queue = []
+rendered_graphs = {}
+RENDER_WORKERS = os.cpu_count() or 1
+GRAPH_MAX_POINTS = 1000  # Downsample longer series, None to plot every point
+GRAPH_DOWNSAMPLING = "lttb"  # "lttb" or "min_max"
+GRAPH_MAX_TICKS = 60  # None to label every point
+
+# Run metrics, written into REPORT_DIR/run_metrics.json
+run_metrics = []
+active_stages = []
+TRACE_MEMORY = False  # Record peak memory per stage with tracemalloc, slows the run down
+PROFILE_STAGES = False  # Dump a cProfile of every stage into REPORT_DIR/profiles
+
+# Report time, seconds east of UTC for day boundaries and labels
+UTC_OFFSET = 0
 
 # Time frame [YYYY/MM/DD]
-START_TIME = parse_date("2025/07/12")
-END_TIME = parse_date("2026/4/4")
-
-# Events
-CHECKPOINTS = [
-  "secondLaunch", "recordingSavedFirstTime", "recordingPreviewPlayedFirstTime", "recordingLoadedFirstTime"
-]
-FUNCTIONS = [
-  "recordingSaved", "recordingPreviewPlayed", "recordingLoaded"
-]
-STATEMENTS = [
-  "sixHoursActivityReport", "newInstallationLaunchReport", "sixHoursUsageTimeReport"
-]
-DEVICE_TYPES = [
-  "Android", "Desktop"
-]
-
+START_DATE = "2025/07/12"
+END_DATE = "2026/4/4"
+START_TIME = parse_date(START_DATE)
+END_TIME = parse_date(END_DATE)
+
+# Variants kept per popularity field, see Popularity counters, None to count every variant exactly
+POPULARITY_CAPACITY = 1000
+
+# Days N of the retention tables and chart
+RETENTION_DAYS = 30
+
+# Names of REPORT_SECTIONS to run, None to run all
+SECTIONS = None
+
+# Reports, one definition per appName, frames of apps without one are non-standard
+#   report_dir         report of the app, None for REPORT_DIR for the first app and REPORT_DIR/appName for the others
+#   statements         statementType values to count
+#   device_types       { deviceType: label }, installations launched on them are counted
+#   checkpoints        { checkpointName: label }, installations reaching them are counted
+#   functions          { usedFunctionName: label }, every use is counted
+#   graphs             statements per time step, per_installation counts an installation once per step
+#   popularity         newInstallationLaunchReport field charts, top adds a chart of the most popular variants,
+#                      capacity overrides POPULARITY_CAPACITY
+REPORTS = {
+	"OpenAudioTools": {
+		"report_dir": None,
+		"statements": ["sixHoursActivityReport", "newInstallationLaunchReport", "sixHoursUsageTimeReport"],
+		"device_types": {
+			"Android": "Android install launches",
+			"Desktop": "Desktop install launches",
+		},
+		"checkpoints": {
+			"secondLaunch": "Second launch",
+			"recordingSavedFirstTime": "Recording saved first time",
+			"recordingPreviewPlayedFirstTime": "Recording preview played first time",
+			"recordingLoadedFirstTime": "Recording loaded first time",
+		},
+		"functions": {
+			"recordingSaved": "Recording saved",
+			"recordingPreviewPlayed": "Recording preview played",
+			"recordingLoaded": "Recording loaded",
+		},
+		"graphs": [
+			{"title": "Active users per hour", "statement": "sixHoursActivityReport",
+			 "time_step": 3600, "per_installation": True},
+			{"title": "Active users per day", "statement": "sixHoursActivityReport",
+			 "time_step": 86400, "per_installation": True},
+			{"title": "Active users per week", "statement": "sixHoursActivityReport",
+			 "time_step": 604800, "per_installation": True},
+			{"title": "Active users per month", "statement": "sixHoursActivityReport",
+			 "time_step": 2419200, "per_installation": True},
+			{"title": "New installation launches per day", "statement": "newInstallationLaunchReport",
+			 "time_step": 86400, "per_installation": True},
+		],
+		"popularity": [
+			{"field": "deviceType", "title": "Platform Popularity"},
+			{"field": "language", "title": "Language Popularity",
+			 "top": 23, "top_title": "Language Popularity (24 most popular)"},
+			{"field": "country", "title": "Country Popularity (By region settings)",
+			 "top": 23, "top_title": "Country Popularity (By region settings) (24 most popular)"},
+			{"field": "timeZone", "title": "Time Zone Popularity",
+			 "top": 23, "top_title": "Time Zone Popularity (24 most popular)"},
+		],
+	},
+}
 
 # Process
-shutil.rmtree(REPORT_DIR)
-data_rows, non_txt, non_json, non_standard = load_telemetry_data()
-display_data(data_rows, non_txt_files=non_txt, non_json_files=non_json, non_standard_files=non_standard)
+def parse_arguments(argv=None):
+	parser = argparse.ArgumentParser(description="Make the OpenAudioTools telemetry report")
+	parser.add_argument("--start", default=START_DATE,
+						help=f"first day of the report window, YYYY/MM/DD (default: {START_DATE})")
+	parser.add_argument("--end", default=END_DATE,
+						help=f"day the report window ends at, YYYY/MM/DD (default: {END_DATE})")
+	parser.add_argument("--utc-offset", type=int, default=UTC_OFFSET,
+						help="seconds east of UTC for day boundaries and labels")
+	parser.add_argument("--source", choices=["zip", "dir"], default=TELEMETRY_SOURCE,
+						help="read the archive or the unpacked directory")
+	parser.add_argument("--telemetry-zip", default=TELEMETRY_ZIP)
+	parser.add_argument("--telemetry-dir", default=TELEMETRY_DIR)
+	parser.add_argument("--report-dir", default=REPORT_DIR)
+	parser.add_argument("--cache-dir", default=CACHE_DIR)
+	parser.add_argument("--sections", type=lambda value: value.split(","), default=SECTIONS,
+						help=f"comma-separated sections to run: {','.join(REPORT_SECTIONS)} (default: all)")
+	parser.add_argument("--stats-only", action="store_true",
+						help=f"run only {','.join(STATS_ONLY_SECTIONS)}, matplotlib is never loaded")
+	parser.add_argument("--full", action="store_true",
+						help="rebuild the report from all files instead of folding in new ones")
+	parser.add_argument("--watch", action="store_true", default=WATCH,
+						help="keep running and update the report as files land")
+	parser.add_argument("--event-store", default=EVENT_STORE, help="SQLite database to load frames into")
+	parser.add_argument("--distinct", choices=["exact", "hll"], default=DISTINCT_COUNTING,
+						help="count active installations exactly or with HyperLogLog sketches")
+	parser.add_argument("--hll-precision", type=int, choices=range(4, 19), default=HLL_PRECISION,
+						metavar="4-18")
+	parser.add_argument("--shards", nargs="+", default=SHARDS, metavar="SOURCE",
+						help="telemetry dirs or zips to build partial reports of in parallel and merge")
+	parser.add_argument("--shard-workers", type=int, default=SHARD_WORKERS)
+	parser.add_argument("--merge", nargs="+", default=PARTIAL_REPORTS, metavar="STATE_DIR",
+						help="merge partial reports built on other nodes into the report")
+	parser.add_argument("--partial-only", action="store_true", default=PARTIAL_ONLY,
+						help="only build the partial reports of the shards")
+	parser.add_argument("--profile", action="store_true", default=PROFILE_STAGES,
+						help="dump a cProfile of every stage into the report dir")
+	parser.add_argument("--trace-memory", action="store_true", default=TRACE_MEMORY,
+						help="record peak memory of every stage")
+	args = parser.parse_args(argv)
+
+	dates = {}
+	for option, value in [("--start", args.start), ("--end", args.end)]:
+		try:
+			dates[option] = datetime.strptime(value, "%Y/%m/%d")
+		except ValueError:
+			parser.error(f"{option} must be a date like {START_DATE}, got {value}")
+	if dates["--end"] <= dates["--start"]:
+		parser.error("--end must be after --start")
+	unknown = set(args.sections or ()) - set(REPORT_SECTIONS)
+	if unknown:
+		parser.error(f"unknown sections: {', '.join(sorted(unknown))}")
+	if (args.shards or args.merge) and args.event_store:
+		parser.error("--event-store cannot be filled by shard workers")
+	if (args.shards or args.merge) and args.watch:
+		parser.error("--watch reports a single source")
+	return args
+
+
+def main(argv=None):
+	global UTC_OFFSET, START_TIME, END_TIME, TELEMETRY_SOURCE, TELEMETRY_ZIP, TELEMETRY_DIR, REPORT_DIR, CACHE_DIR
+	global SECTIONS, INCREMENTAL_REPORT, WATCH, EVENT_STORE, PROFILE_STAGES, TRACE_MEMORY
+	global SHARDS, SHARD_WORKERS, PARTIAL_REPORTS, PARTIAL_ONLY, DISTINCT_COUNTING, HLL_PRECISION
+
+	# Arguments override the config above
+	args = parse_arguments(argv)
+	UTC_OFFSET = args.utc_offset
+	START_TIME = parse_date(args.start)
+	END_TIME = parse_date(args.end)
+	TELEMETRY_SOURCE = args.source
+	TELEMETRY_ZIP = args.telemetry_zip
+	TELEMETRY_DIR = args.telemetry_dir
+	REPORT_DIR = args.report_dir
+	CACHE_DIR = args.cache_dir
+	SECTIONS = STATS_ONLY_SECTIONS if args.stats_only else args.sections
+	INCREMENTAL_REPORT = INCREMENTAL_REPORT and not args.full
+	WATCH = args.watch
+	EVENT_STORE = args.event_store
+	DISTINCT_COUNTING = args.distinct
+	HLL_PRECISION = args.hll_precision
+	PROFILE_STAGES = args.profile
+	TRACE_MEMORY = args.trace_memory
+	SHARDS = args.shards
+	SHARD_WORKERS = args.shard_workers
+	PARTIAL_REPORTS = args.merge
+	PARTIAL_ONLY = args.partial_only
+
+	# Fail before ingesting when apps would overwrite each other's report
+	get_app_report_dirs()
+
+	if WATCH:
+		watch_telemetry()
+	elif SHARDS or PARTIAL_REPORTS or PARTIAL_ONLY:
+		# Merging partial reports of other nodes only does not read the local source
+		shards = SHARDS or ([] if PARTIAL_REPORTS else [get_telemetry_source()])
+		report_shards(shards, PARTIAL_REPORTS, PARTIAL_ONLY)
+	elif INCREMENTAL_REPORT:
+		with measure_stage("ingest"):
+			state = update_report_state()
+		display_report_state(state)
+		save_run_metrics()
+	else:
+		clear_report_dir()
+		rejected_counts = {}
+		with measure_stage("ingest"):
+			app_aggregates = aggregate_telemetry(rejected_counts=rejected_counts)
+		display_aggregates(app_aggregates, non_txt_files=rejected_counts["non_txt"],
+						   non_json_files=rejected_counts["non_json"],
+						   non_standard_files=rejected_counts["non_standard"])
+		save_run_metrics()
+
+
+if __name__ == "__main__":
+	main()
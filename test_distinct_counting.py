@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import make_telemetry_report_for_openaudiotools as report
+
+
+PRECISION = 12
+RELATIVE_ERROR = 1.04 / np.sqrt(2 ** PRECISION)
+
+
+def build_sketch(installation_ids, precision=PRECISION):
+	sketch = bytearray(1 << precision)
+	for installation_id in installation_ids:
+		report.add_to_sketch(sketch, report.hash_installation(installation_id), precision)
+	return np.frombuffer(sketch, dtype=np.uint8)
+
+
+def get_installation_ids(first, last):
+	return [f"installation-{i}" for i in range(first, last)]
+
+
+@pytest.mark.parametrize("count", [0, 1, 10, 100, 1000, 10000, 100000])
+def test_estimate_distinct_is_close_to_exact_count(count):
+	# Within 3 standard errors, small counts are exact
+	estimate = report.estimate_distinct(build_sketch(get_installation_ids(0, count))[None])[0]
+	assert abs(estimate - count) <= max(1, 3 * RELATIVE_ERROR * count)
+
+
+def test_estimate_distinct_of_merged_sketches_counts_union():
+	# Installations in both sketches are counted once
+	sketches = np.stack([build_sketch(get_installation_ids(0, 6000)), build_sketch(get_installation_ids(4000, 10000))])
+	estimates = report.estimate_distinct(sketches)
+	merged = report.estimate_distinct(sketches.max(axis=0))
+	assert abs(merged - 10000) <= 3 * RELATIVE_ERROR * 10000
+	assert all(abs(estimate - 6000) <= 3 * RELATIVE_ERROR * 6000 for estimate in estimates)
+
+
+def test_sketched_rollups_match_exact_rollups(monkeypatch):
+	# Every installation launches once and reports activity in a few hours of the window
+	start_time = report.START_TIME
+	frames = []
+	for i, installation_id in enumerate(get_installation_ids(0, 3000)):
+		frame = {"appName": "OpenAudioTools", "installationId": installation_id, "deviceType": "Android"}
+		frames.append(dict(frame, statementType="newInstallationLaunchReport", unixTime=start_time + i))
+		for hour in range(i % 5):
+			frames.append(dict(frame, statementType="sixHoursActivityReport", unixTime=start_time + hour * 3600 + i))
+
+	def build_rollups(distinct_counting):
+		monkeypatch.setattr(report, "DISTINCT_COUNTING", distinct_counting)
+		reports = report.build_report_states(report.aggregate_frames([[dict(frame) for frame in frames]]))
+		return reports["OpenAudioTools"]["rollups"]
+
+	exact = build_rollups("exact")
+	sketched = build_rollups("hll")
+	end_time = start_time + 86400
+	for statement in ["newInstallationLaunchReport", "sixHoursActivityReport", "Android"]:
+		exact_count = report.count_users_with_existent_statement(exact, statement, start_time, end_time)
+		estimate = report.count_users_with_existent_statement(sketched, statement, start_time, end_time)
+		assert abs(estimate - exact_count) <= 3 * RELATIVE_ERROR * exact_count
+		assert (report.count_statements(sketched, statement, start_time, end_time) ==
+				report.count_statements(exact, statement, start_time, end_time))
+
+	# Statements only counted as events are not sketched
+	assert "sketches" not in sketched["statements"]["sixHoursUsageTimeReport"]
+	for key in ["first", "last", "counts"]:
+		assert np.array_equal(sketched["lifetime"][key], exact["lifetime"][key])
@@ -0,0 +1,126 @@
+import hashlib
+import http.server
+import io
+import json
+import threading
+import urllib.parse
+import zipfile
+
+import pytest
+
+import download_telemetry as download
+
+
+def make_frame(unix_time):
+	return json.dumps({"unixTime": str(unix_time), "installationId": f"installation-{unix_time % 7}",
+					   "appName": "OpenAudioTools", "statementType": "sixHoursActivityReport"})
+
+
+def make_archive(frames):
+	buffer = io.BytesIO()
+	with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+		for filename, content in sorted(frames.items()):
+			archive.writestr(filename, content)
+	return buffer.getvalue()
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+	# A local stand-in of download_telemetry.php: POST the key and get the archive,
+	# honours Range, can drop connections halfway and filter frames by since_unix_time
+	protocol_version = "HTTP/1.1"
+
+	def log_message(self, *args):
+		pass
+
+	def do_POST(self):
+		server = self.server
+		form = urllib.parse.parse_qs(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+		since = int(form.get("since_unix_time", ["0"])[0])
+		frames = {filename: content for filename, content in server.frames.items()
+				  if not server.filter_frames or int(json.loads(content)["unixTime"]) > since}
+		data = server.archive if server.archive is not None else make_archive(frames)
+
+		byte_range = self.headers.get("Range")
+		start = int(byte_range.split("=")[1].rstrip("-")) if byte_range else 0
+		body = data[start:]
+		status = 206 if byte_range else 200
+		server.requests.append((byte_range, status))
+
+		self.send_response(status)
+		if byte_range:
+			self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+		self.send_header("Content-Length", str(len(body)))
+		self.send_header(download.CHECKSUM_HEADER, hashlib.sha256(data).hexdigest())
+		self.end_headers()
+
+		if server.drops:
+			server.drops -= 1
+			self.wfile.write(body[:len(body) // 2])
+			self.wfile.flush()
+			self.close_connection = True
+			self.connection.shutdown(2)
+			return
+		self.wfile.write(body)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setattr(download.time, "sleep", lambda seconds: None)
+	with open("api_key.txt", "w", encoding="utf-8") as f:
+		f.write("key")
+	monkeypatch.setattr(download, "API_KEY_FILE", "api_key.txt")
+
+	server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+	server.frames = {}
+	server.archive = None
+	server.filter_frames = True
+	server.drops = 0
+	server.requests = []
+	server.url = f"http://127.0.0.1:{server.server_address[1]}/download_telemetry.php"
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+
+def read_store():
+	with zipfile.ZipFile(download.TELEMETRY_ZIP) as store:
+		return {info.filename: store.read(info).decode("utf-8") for info in store.infolist()}
+
+
+def test_download_resumes_after_dropped_connection(server, monkeypatch):
+	# Chunks much smaller than the archive, the chunk cut by the dropped connection is downloaded again
+	monkeypatch.setattr(download, "CHUNK_SIZE", 1024)
+	frames = {f"{1752300000 + i}_{i}.txt": make_frame(1752300000 + i) + " " * 1000 for i in range(200)}
+	server.archive = make_archive(frames)
+	server.drops = 1
+
+	download.download_archive(server.url, "key", "archive.zip")
+
+	(first_range, first_status), (resumed_range, resumed_status) = server.requests
+	offset = int(resumed_range.split("=")[1].rstrip("-"))
+	assert (first_range, first_status, resumed_status) == (None, 200, 206)
+	assert 0 < offset <= len(server.archive) // 2
+	assert download.file_sha256("archive.zip") == hashlib.sha256(server.archive).hexdigest()
+
+
+@pytest.mark.parametrize("filter_frames", [True, False])
+def test_sync_adds_only_new_frames(server, capsys, filter_frames):
+	# Servers that ignore the watermark send the full history, which is merged the same way
+	server.filter_frames = filter_frames
+	server.frames = {f"{1752300000 + i}_{i}.txt": make_frame(1752300000 + i) for i in range(20)}
+
+	download.sync(server.url)
+	assert read_store() == server.frames
+	assert "Synced 20 new frames" in capsys.readouterr().out
+
+	download.sync(server.url)
+	assert read_store() == server.frames
+	assert "Synced 0 new frames" in capsys.readouterr().out
+
+	server.frames.update({f"{1752400000 + i}_{i}.txt": make_frame(1752400000 + i) for i in range(5)})
+	download.sync(server.url)
+	assert read_store() == server.frames
+	assert "Synced 5 new frames" in capsys.readouterr().out
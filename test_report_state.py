@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pytest
+
+import benchmark_telemetry_report as benchmark
+import make_telemetry_report_for_openaudiotools as report
+
+
+APP_NAME = "OpenAudioTools"
+
+
+@pytest.fixture
+def telemetry(tmp_path, monkeypatch):
+	# A small synthetic source as files sorted by the unixTime their names start with
+	monkeypatch.setattr(report, "CACHE_DIR", str(tmp_path / "cache"))
+	monkeypatch.setattr(report, "REPORT_DIR", str(tmp_path / "report"))
+	monkeypatch.setattr(report, "INGEST_WORKERS", 1)
+	files = sorted(benchmark.generate_synthetic_files(60, 20, 1), key=lambda file: int(file[0].split("_")[0]))
+	write_files(tmp_path / "all", files)
+	return tmp_path, files
+
+
+def write_files(source, files):
+	os.makedirs(source, exist_ok=True)
+	for filename, content in files:
+		with open(os.path.join(source, filename), "w", encoding="utf-8") as f:
+			f.write(content)
+
+
+def build_full_report(source):
+	rejected_counts = {}
+	reports = report.build_report_states(report.aggregate_telemetry(
+		telemetry_source=str(source), rejected_counts=rejected_counts))
+	return reports[APP_NAME], rejected_counts
+
+
+def canonical(app_report):
+	# Rollups keyed by installationId instead of installation codes, which depend on the order files are read in
+	users = app_report["users"]
+	rollups = app_report["rollups"]
+	users_count = rollups["users_count"]
+	statements = {}
+	for statement, rollup in rollups["statements"].items():
+		active = rollup["active"]
+		statements[statement] = (
+			dict(zip(rollup["hours"].tolist(), rollup["counts"].tolist())),
+			sorted(zip((active // users_count).tolist(), [users[code] for code in (active % users_count).tolist()])))
+
+	usage = rollups["usage"]
+	boundary = {users[code]: tuple(int(usage[key][i]) for key in report.USAGE_BOUNDARY_KEYS[1:])
+				for i, code in enumerate(usage["boundary_codes"].tolist())}
+	lifetime = rollups["lifetime"]
+	lifetimes = {user: (int(lifetime["first"][code]), int(lifetime["last"][code]), int(lifetime["counts"][code]))
+				 for code, user in enumerate(users) if lifetime["counts"][code]}
+	return {
+		"statements": statements,
+		"ratings": (rollups["ratings"]["hours"].tolist(), rollups["ratings"]["counts"].tolist()),
+		"usage": dict(zip(usage["hours"].tolist(), usage["seconds"].tolist())),
+		"boundary": boundary,
+		"lifetime": lifetimes,
+		"feedback": {day: sorted(lines) for day, lines in app_report["feedback"].items()},
+		"popularity": {field: {day: counter["counts"] for day, counter in counters_per_day.items()}
+					   for field, counters_per_day in app_report["popularity"].items()},
+	}
+
+
+def test_folded_state_matches_full_build(telemetry, monkeypatch):
+	tmp_path, files = telemetry
+	full, rejected_counts = build_full_report(tmp_path / "all")
+
+	# Only the first update builds the state, the others fold new files in
+	rebuilds = []
+	rebuild_report_state = report.rebuild_report_state
+
+	def count_rebuilds(*args):
+		rebuilds.append(args)
+		return rebuild_report_state(*args)
+
+	monkeypatch.setattr(report, "rebuild_report_state", count_rebuilds)
+	for chunk in np.array_split(np.arange(len(files)), 4):
+		write_files(tmp_path / "grow", [files[i] for i in chunk])
+		state = report.update_report_state(str(tmp_path / "grow"))
+
+	assert len(rebuilds) == 1
+	assert state["rejected"] == rejected_counts
+	assert canonical(state["reports"][APP_NAME]) == canonical(full)
+	saved = report.load_report_state(report.get_report_state_dir(str(tmp_path / "grow")))
+	assert canonical(saved["reports"][APP_NAME]) == canonical(full)
+
+
+def test_merged_shards_match_full_build(telemetry):
+	tmp_path, files = telemetry
+	full, rejected_counts = build_full_report(tmp_path / "all")
+
+	# Shards split by time
+	shards = []
+	for number, chunk in enumerate(np.array_split(np.arange(len(files)), 3)):
+		shards.append(str(tmp_path / f"shard{number}"))
+		write_files(shards[-1], [files[i] for i in chunk])
+	state = report.reduce_partial_reports(report.update_partial_reports(shards, workers=1))
+
+	assert state["rejected"] == rejected_counts
+	assert len(state["files"]) == len(files)
+	assert canonical(state["reports"][APP_NAME]) == canonical(full)